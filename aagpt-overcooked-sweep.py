@@ -0,0 +1,125 @@
+import argparse
+import copy
+import csv
+import importlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import yaml
+from overcooked.env import SUPPORTED_LEVELS
+from overcooked.utils import setup_logging
+
+
+"""
+Benchmark sweep for ChatGPT for Overcooking: levels x seeds x tasks in a process pool
+"""
+REPORT_FIELDS = ["level", "task", "seed", "success", "steps", "num_subtasks",
+                 "wall_time_per_tick", "llm_latency", "llm_calls", "llm_prompt_tokens", "plan_cache_hit",
+                 "wall_time", "error"]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser("Overcooked sweep argument parser")
+    parser.add_argument('--world_root', type=str, default='setup/gameovercooked.yaml')
+    parser.add_argument("--levels", type=str, nargs="+", default=SUPPORTED_LEVELS, choices=SUPPORTED_LEVELS, help="Levels to run")
+    parser.add_argument("--seeds", type=int, nargs=2, default=[1, 5], metavar=("FIRST", "LAST"), help="Inclusive seed range")
+    parser.add_argument("--tasks", type=str, nargs="+", default=None, help="Tasks to run (defaults to the task of the world yaml)")
+    parser.add_argument("--max-num-timesteps", type=int, default=200, help="Max number of timesteps per episode")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--output", type=str, default="sweep_report.json", help="JSON report path")
+    parser.add_argument("--use-plan-cache", action="store_true", default=False, help="Reuse cached plans (LLM metrics then depend on the run order)")
+    parser.add_argument("--requests-per-minute", type=float, default=None, help="LLM requests per minute of the API key, split evenly between the workers")
+    parser.add_argument("--tokens-per-minute", type=float, default=None, help="LLM tokens per minute of the API key, split evenly between the workers")
+    parser.add_argument("--csv", type=str, default=None, help="Optional CSV report path (one row per run)")
+    return parser.parse_args()
+
+
+def run_one(world_root: str, ws: dict, level: str, seed: int, task: str, max_num_timesteps: int,
+            use_plan_cache: bool=False) -> dict:
+    """ run a single headless episode and return its metrics """
+    runner = importlib.import_module("aagpt-overcooked")
+    argv = ["--world_root", world_root, "--headless", "--seed", str(seed), "--max-num-timesteps", str(max_num_timesteps)]
+    if not use_plan_cache:
+        # every run asks the LLM, so the LLM metrics do not depend on the order of the runs
+        argv.append("--no-plan-cache")
+    args = runner.parse_arguments(argv)
+    setup_logging(quiet=True)
+    runner.fix_seed(seed=seed)
+    ws = copy.deepcopy(ws)
+    ws["common"]["level"] = level
+    ws["common"]["task"] = task
+    result = {"level": level, "task": task, "seed": seed, "success": False, "error": None}
+    start = time.perf_counter()
+    try:
+        result.update(runner.main_loop(args, ws))
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["wall_time"] = time.perf_counter() - start
+    return result
+
+
+def summarize(results: list) -> list:
+    """ aggregate the runs per (level, task) """
+    groups = {}
+    for r in results:
+        groups.setdefault((r["level"], r["task"]), []).append(r)
+    summary = []
+    for (level, task), runs in groups.items():
+        succeeded = [r for r in runs if r["success"]]
+        summary.append({
+            "level": level, "task": task, "runs": len(runs),
+            "success_rate": len(succeeded) / len(runs),
+            "mean_steps_to_completion": sum(r["steps"] for r in succeeded) / len(succeeded) if succeeded else None,
+            "mean_wall_time_per_tick": _mean(r.get("wall_time_per_tick") for r in runs),
+            "mean_llm_latency": _mean(r.get("llm_latency") for r in runs),
+            "plan_cache_hit_rate": sum(bool(r.get("plan_cache_hit")) for r in runs) / len(runs),
+        })
+    return summary
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+def main():
+    args = parse_arguments()
+    with open(args.world_root, 'r') as f:
+        ws = yaml.load(f, Loader=yaml.FullLoader)
+    tasks = args.tasks if args.tasks else [ws["common"]["task"]]
+    jobs = [(level, seed, task) for level in args.levels
+            for seed in range(args.seeds[0], args.seeds[1] + 1) for task in tasks]
+    # every worker process has its own limiter, each gets an equal share of the key's limits
+    for key in ("requests_per_minute", "tokens_per_minute"):
+        limit = getattr(args, key) or ws["common"].get(key)
+        if limit:
+            ws["common"][key] = limit / args.workers
+    print(f"Running {len(jobs)} episodes on {args.workers} workers...")
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(run_one, args.world_root, ws, level, seed, task, args.max_num_timesteps,
+                               args.use_plan_cache)
+                   for level, seed, task in jobs]
+        results = [future.result() for future in futures]
+    report = {
+        "model": ws["common"]["openai_model"],
+        "max_num_timesteps": args.max_num_timesteps,
+        "total_wall_time": time.perf_counter() - start,
+        "summary": summarize(results),
+        "runs": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(results)
+    for row in report["summary"]:
+        print(f"{row['level']:<28s} {row['task'][:40]:<40s} success={row['success_rate']:.2f} steps={row['mean_steps_to_completion']}")
+    print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
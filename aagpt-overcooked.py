@@ -1,69 +1,91 @@
 import argparse
+import time
 import cv2
 import yaml
 from overcooked.agent import GPTAgent, ChatBot
 from overcooked.env import OvercookedEnvGPT
-from overcooked.utils import get_task_queue, colors, fix_seed
+from overcooked.plan_cache import PlanCache
+from overcooked.plan_sim import PlanSimulator
+from overcooked.scheduler import TaskScheduler
+from overcooked.utils import get_task_queue, colors, fix_seed, logger, setup_logging, ReservationTable
 
 
 """
 ChatGPT for Overcooking
 """
-def parse_arguments():
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser("Overcooked 2 argument parser")
     # Environment
     parser.add_argument('--world_root', type=str, default='setup/gameovercooked.yaml')
-    parser.add_argument("--max-num-timesteps", type=int, default=100, help="Max number of timesteps to run")
+    parser.add_argument("--max-num-timesteps", type=int, default=200, help="Max number of timesteps to run")
     parser.add_argument("--max-num-subtasks", type=int, default=14, help="Max number of subtasks for recipe")
     parser.add_argument("--seed", type=int, default=1, help="Fix pseudorandom seed")
     parser.add_argument("--with-image-obs", action="store_true", default=True, help="Return observations as images (instead of objects)")
+    parser.add_argument("--no-image-obs", dest="with_image_obs", action="store_false", help="Do not create image observations (headless runs)")
+    parser.add_argument("--frame-skip", type=int, default=1, help="Provide an image observation every N timesteps")
+    parser.add_argument("--full-obs-copy", action="store_true", default=False, help="Return a full copy of the environment as observation (instead of a compact snapshot)")
     # Visualizations
     parser.add_argument("--record", action="store_true", default=False, help="Save observation at each time step as an image in misc/game/record")
     parser.add_argument("--render", action="store_true", help="render the images")
+    parser.add_argument("--quiet", action="store_true", default=False, help="Only log warnings and errors")
+    parser.add_argument("--headless", action="store_true", default=False, help="Quiet mode without rendering or image observations")
     # GPT
     parser.add_argument("--gpt", action="store_true", default=True)
-    return parser.parse_args()
+    parser.add_argument("--plan-cache-dir", type=str, default=".plan_cache", help="Directory of the generated plan cache")
+    parser.add_argument("--plan-cache-size", type=int, default=256, help="Max number of cached plans")
+    parser.add_argument("--no-plan-cache", action="store_true", default=False, help="Always ask the LLM for a new plan and do not cache it")
+    parser.add_argument("--regenerate-plan", action="store_true", default=False, help="Ask the LLM for a new plan and overwrite the cached one")
+    parser.add_argument("--concurrent", action="store_true", default=False, help="Let both agents work on independent subtasks in the same timestep")
+    parser.add_argument("--cooperative-paths", action="store_true", default=False, help="Plan paths around the other agent with a space-time reservation table")
+    parser.add_argument("--context-budget", type=int, default=None, help="Max prompt tokens sent to the LLM (default: common.context_budget in the yaml, or 3000)")
+    parser.add_argument("--requests-per-minute", type=float, default=None, help="LLM requests per minute allowed to this process (default: common.requests_per_minute in the yaml, or unlimited)")
+    parser.add_argument("--tokens-per-minute", type=float, default=None, help="LLM tokens per minute allowed to this process (default: common.tokens_per_minute in the yaml, or unlimited)")
+    parser.add_argument("--llm-cache", type=str, default=None, help="SQLite file of recorded LLM responses (default: common.llm_cache in the yaml)")
+    parser.add_argument("--llm-cache-mode", type=str, default=None, choices=["off", "record", "replay"], help="off, record (reuse and store responses) or replay (recorded responses only, no network)")
+    parser.add_argument("--num-plans", type=int, default=1, help="Request this many candidate plans in one call and keep the one with the fewest simulated steps")
+    args = parser.parse_args(argv)
+    if args.frame_skip < 1:
+        parser.error(f"--frame-skip must be at least 1: {args.frame_skip}")
+    if args.headless:
+        args.quiet = True
+        args.render = False
+        args.with_image_obs = False
+    if args.render:
+        args.with_image_obs = True
+    return args
 
 
-def main_loop(args):
-    """The main loop for running experiments."""
-    print("Initializing environment and agents.")
-    
-    # Load world setup from YAML file
-    with open(args.world_root, 'r') as f:
-        ws = yaml.load(f, Loader=yaml.FullLoader)
-    
-    num_agents = ws["common"]["agents"]["n"]
-    level =  ws["common"]["level"]
-    env = OvercookedEnvGPT(num_agents, level, arglist=args)
-    obs = env.reset()
-    
-    # initialize the agent
-    agent1 = GPTAgent(1, level, args)
-    agent2 = GPTAgent(2, level, args)
+def render(args, info):
+    if args.render and info['image_obs'] is not None:
+        cv2.imshow('Overcooked', info['image_obs']()[:,:,::-1])
+        cv2.waitKey(30)
 
-    chatbot = ChatBot(num_agents, ws, args)
 
-    task_queue = get_task_queue(ws, chatbot, agent1, agent2) 
+def begin_tick(info, agents):
+    # every tick starts with all agents parked where they stand
+    reservations = agents[0].reservations
+    if reservations is not None:
+        reservations.begin_tick(info["t"], {agent.id: info["agents_states"][f"agent-{agent.id}"]["loc"] for agent in agents})
 
-    # start to do the queue 
-    task_id, cur_agent_id, global_steps, max_steps = 0, 0, 1, 200
-    # initialise the agent's state
-    action_dict = {'agent-1': (0, 0), 'agent-2': (0, 0)}
-    _, _, _, info = env.step(action_dict=action_dict)
+
+def run_sequential(args, env, info, task_queue, agent1, agent2, max_steps):
+    """Runs the task queue one subtask at a time; the other agent waits."""
+    task_id, cur_agent_id, global_steps = 0, 0, 1
+    success = False
     while True:
+        begin_tick(info, [agent1, agent2])
         f = task_queue[task_id][0]
         arg = task_queue[task_id][1]
         if str(agent1) in str(f):
             cur_agent_id = 1
-            print("agent1 is in the task")
+            logger.debug("agent1 is in the task")
             agent1.reset_state()
             # update state
             agent1_states = info["agents_states"]["agent-1"]
             agent1.set_state(location=agent1_states["loc"], action_str=agent1_states["action_str"], action_loc=agent1_states["action_loc"])
         elif str(agent2) in str(f):
             cur_agent_id = 2
-            print("agent2 is in the task")
+            logger.debug("agent2 is in the task")
             agent2.reset_state()
             # update state
             agent2_states = info["agents_states"]["agent-2"]
@@ -78,20 +100,118 @@ def main_loop(args):
         _, _, _, info = env.step(action_dict=action_dict)
         global_steps += 1
         if global_steps > max_steps:
-            print("Max Timestep Has Reached!")
+            logger.warning("Max Timestep Has Reached!")
             break
-        if args.render:
-            cv2.imshow('Overcooked', info['image_obs'][:,:,::-1])
-            cv2.waitKey(30)
+        render(args, info)
         if subtask_finish:
-            print(colors.GREEN + f"task complete: {str(f)}({str(arg)})" + colors.ENDC)
+            logger.info(colors.GREEN + "task complete: %s(%s)" + colors.ENDC, f, arg)
             task_id += 1
             if task_id == len(task_queue):
                 print(colors.GREEN + f"ALL TASKS COMPLETE: score={global_steps} (lower the better)" + colors.ENDC)
+                success = True
                 break
+    return global_steps, success
+
+
+def run_concurrent(args, env, info, task_queue, agents, max_steps):
+    """Lets every agent advance its own next subtask as soon as the subtasks
+    it depends on are done, so independent subtasks share an env.step."""
+    scheduler = TaskScheduler(task_queue)
+    global_steps = 1
+    success = False
+    while True:
+        begin_tick(info, agents)
+        action_dict = {}
+        for agent in agents:
+            name = f"agent-{agent.id}"
+            action_dict[name] = (0, 0)
+            agent.reset_state()
+            # update state
+            states = info["agents_states"][name]
+            agent.set_state(location=states["loc"], action_str=states["action_str"], action_loc=states["action_loc"])
+            task_id = scheduler.next_for(agent.id)
+            if task_id is None:
+                continue
+            f, arg = task_queue[task_id][0], task_queue[task_id][1]
+            logger.debug("agent%d is in the task %d", agent.id, task_id)
+            # execute the subtask...
+            subtask_finish, action_dict[name] = f(arg)
+            if subtask_finish:
+                logger.info(colors.GREEN + "task complete: %s(%s)" + colors.ENDC, f, arg)
+                scheduler.complete(task_id)
+        # execute the actions of all agents at once
+        _, _, _, info = env.step(action_dict=action_dict)
+        global_steps += 1
+        if global_steps > max_steps:
+            logger.warning("Max Timestep Has Reached!")
+            break
+        render(args, info)
+        if scheduler.finished:
+            print(colors.GREEN + f"ALL TASKS COMPLETE: score={global_steps} (lower the better)" + colors.ENDC)
+            success = True
+            break
+    return global_steps, success
+
+
+def main_loop(args, ws=None):
+    """The main loop for running experiments.
+
+    Returns a dict with the episode metrics: success, steps, number of subtasks,
+    wall time per tick (decision + env.step), LLM latency, calls and prompt tokens,
+    and whether the plan came from the plan cache.
+    """
+    logger.info("Initializing environment and agents.")
+    
+    # Load world setup from YAML file
+    if ws is None:
+        with open(args.world_root, 'r') as f:
+            ws = yaml.load(f, Loader=yaml.FullLoader)
+    
+    num_agents = ws["common"]["agents"]["n"]
+    level =  ws["common"]["level"]
+    env = OvercookedEnvGPT(num_agents, level, arglist=args)
+    obs = env.reset()
+    
+    # initialize the agent
+    agent1 = GPTAgent(1, level, args)
+    agent2 = GPTAgent(2, level, args, item_locations=agent1.item_locations)
+    if args.cooperative_paths:
+        agent1.reservations = agent2.reservations = ReservationTable()
+
+    chatbot = ChatBot(num_agents, ws, args)
+
+    llm_start = time.perf_counter()
+    plan_cache = None if args.no_plan_cache else PlanCache(args.plan_cache_dir, args.plan_cache_size)
+    simulator = PlanSimulator(agent1.level, agent1.item_locations)
+    start_locations = {int(a.name.split("-")[-1]): a.location for a in env.sim_agents}
+    def score_plan(task_queue):
+        estimate = simulator.simulate(task_queue, start_locations)
+        return estimate.steps if estimate.feasible else None
+    task_queue = get_task_queue(ws, chatbot, agent1, agent2, plan_cache=plan_cache, regenerate=args.regenerate_plan,
+                                num_candidates=args.num_plans, scorer=score_plan)
+    llm_latency = time.perf_counter() - llm_start
+
+    # start to do the queue 
+    max_steps = args.max_num_timesteps
+    loop_start = time.perf_counter()
+    # initialise the agent's state
+    action_dict = {'agent-1': (0, 0), 'agent-2': (0, 0)}
+    _, _, _, info = env.step(action_dict=action_dict)
+    if args.concurrent:
+        global_steps, success = run_concurrent(args, env, info, task_queue, [agent1, agent2], max_steps)
+    else:
+        global_steps, success = run_sequential(args, env, info, task_queue, agent1, agent2, max_steps)
+    loop_time = time.perf_counter() - loop_start
+    return {"level": level, "task": ws["common"]["task"], "seed": args.seed,
+            "success": success, "steps": global_steps, "num_subtasks": len(task_queue),
+            "wall_time_per_tick": loop_time / global_steps,
+            "llm_latency": llm_latency, "llm_calls": len(chatbot.latencies),
+            "llm_prompt_tokens": sum(chatbot.prompt_tokens),
+            "plan_cache_hit": plan_cache is not None and plan_cache.hits > 0}
 
 
 if __name__ == '__main__':
     args = parse_arguments()
+    setup_logging(quiet=args.quiet)
     fix_seed(seed=args.seed)
     main_loop(args)
@@ -5,6 +5,7 @@ import yaml
 
 from agent import AgentGPTMEM, AgentPCMEM
 from env import Env
+import llm_cache
 import utils
 
 
@@ -14,11 +15,18 @@ def setup_world():
     # Parse command line arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('--world_root', type=str, default='setup/game.yaml')
+    parser.add_argument('--llm-cache', type=str, default=None, help='SQLite file of recorded LLM responses')
+    parser.add_argument('--llm-cache-mode', type=str, default=None, choices=llm_cache.MODES,
+                        help='off, record (reuse and store responses) or replay (recorded responses only, no network)')
     args = parser.parse_args()
     
     # Load world setup from YAML file
     with open(args.world_root, 'r') as f:
         ws = yaml.load(f, Loader=yaml.FullLoader)
+    if args.llm_cache:
+        ws['common']['llm_cache'] = args.llm_cache
+    if args.llm_cache_mode:
+        ws['common']['llm_cache_mode'] = args.llm_cache_mode
     
     # Perform common setup operations
     utils.common(ws)
@@ -53,16 +61,26 @@ def main_loop(agent, env):
             print("\033[92m" + task["task_name"] + "\033[0m")
 
             # Execute the task in the environment
-            result = env.exec(agent, task)
             print("\033[93m\033[1m" + "\nRESULT:\n" + "\033[0m\033[0m")
-            print("\033[93m" + result + "\033[0m")
+            if env.stream:
+                # Print the result as it arrives
+                chunks = []
+                for chunk in env.exec_stream(agent, task):
+                    print("\033[93m" + chunk + "\033[0m", end="", flush=True)
+                    chunks.append(chunk)
+                print()
+                result = "".join(chunks).strip()
+            else:
+                result = env.exec(agent, task)
+                print("\033[93m" + result + "\033[0m")
 
             # Update the agent with the task result
             agent.receive(result)
 
         print("\n" + "\033[91m" + "LIFE: " + str(time_step) + "/" + str(agent.life)+ "\033[0m")
-        # Sleep for 1 second before the next iteration
-        time.sleep(1)
+        # Sleep for 1 second before the next iteration (replayed responses need no throttling)
+        if llm_cache.get_cache().mode != "replay":
+            time.sleep(1)
 
         # End the loop if the agent's life is over
         if time_step > agent.life:
@@ -1,6 +1,6 @@
 from collections import deque
 from typing import Dict, List
-from utils import memory_as_pinecone, get_ada_embedding, openai_call
+from utils import memory_as_local, memory_as_pinecone, get_ada_embedding, openai_call
 
 
 class AgentGPTMEM:
@@ -103,7 +103,7 @@ class AgentGPTMEM:
 class AgentPCMEM:
     def __init__(self, config):
         self.agent_config = config["agent"]
-        self.pinecone_index = self.agent_config["agent_pinecone_index"] 
+        self.pinecone_index = self.agent_config.get("agent_pinecone_index")
         self.task_list = deque([])
         self.memory = self.build_memory()
         self.life = self.agent_config["agent_life"]
@@ -112,9 +112,13 @@ class AgentPCMEM:
         self.task_id_counter = 1
         self.task_turnon = None
         self.goal = self.agent_config["goal"]
+        # the goal never changes, embed it once
+        self.goal_embedding = None
 
     def build_memory(self):
-        """Create Pinecone index and return it as memory."""
+        """Create Pinecone index (or a local one for agent_localmem) and return it as memory."""
+        if self.agent_config["agent_type"] == "agent_localmem":
+            return memory_as_local(self.agent_config.get("agent_memory_path", ".vector_memory"))
         index = memory_as_pinecone(self.pinecone_index)
         return index
 
@@ -186,7 +190,9 @@ class AgentPCMEM:
     
 
     def context_search(self, n: int):
-        query_embedding = get_ada_embedding(self.goal)
+        if self.goal_embedding is None:
+            self.goal_embedding = get_ada_embedding(self.goal)
+        query_embedding = self.goal_embedding
         results = self.memory.query(query_embedding, top_k=n, include_metadata=True, namespace=self.goal)
         sorted_results = sorted(results.matches, key=lambda x: x.score, reverse=True)
         return [(str(item.metadata["task"])) for item in sorted_results]
\ No newline at end of file
@@ -0,0 +1,287 @@
+import ast
+import asyncio
+import hashlib
+import math
+import random
+import re
+import time
+from typing import Dict, Iterator, List
+import openai
+import llama_worker
+import rate_limiter
+
+
+"""
+LLM backends behind utils.openai_call, selected by name from a registry:
+    openai_chat        OpenAI chat completion API (gpt-* models)
+    openai_completion  OpenAI completion API (text-davinci-003, ...)
+    llama              local llama.cpp server, see llama_worker
+    mock               deterministic local responses, no network
+The backend is common.backend in the config yaml, or inferred from common.openai_model.
+"""
+
+BACKENDS: Dict[str, type] = {}
+
+
+def register(name: str):
+    """ class decorator adding a backend to the registry """
+    def wrap(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return wrap
+
+
+class Backend:
+    name = None
+
+    def __init__(self, model: str, config: dict):
+        """
+        Args:
+            model (str): model name
+            config (dict): the `common` section of the config yaml
+        """
+        self.model = model
+        self.config = config
+
+    def complete(self, prompt: str, temperature: float, max_tokens: int) -> str:
+        raise NotImplementedError
+
+    async def acomplete(self, prompt: str, temperature: float, max_tokens: int) -> str:
+        """ async version of complete, runs complete in a worker thread unless overridden """
+        return await asyncio.to_thread(self.complete, prompt, temperature, max_tokens)
+
+    def stream(self, prompt: str, temperature: float, max_tokens: int) -> Iterator[str]:
+        """ chunks of the completion as they are generated; closing the generator cancels the rest """
+        yield self.complete(prompt, temperature, max_tokens)
+
+    def embed(self, texts: List[str], model: str) -> List[List[float]]:
+        """ embeddings of the texts from one request, in order (OpenAI unless overridden) """
+        limiter = rate_limiter.get_limiter()
+        estimated = sum(rate_limiter.count_tokens(text, model) for text in texts)
+        response = limiter.call(lambda: openai.Embedding.create(input=texts, model=model), estimated)
+        _settle(limiter, estimated, response)
+        return [item["embedding"] for item in sorted(response["data"], key=lambda item: item["index"])]
+
+
+@register("openai_chat")
+class OpenAIChatBackend(Backend):
+    def complete(self, prompt, temperature, max_tokens):
+        limiter = rate_limiter.get_limiter()
+        # the limiter charges the prompt plus the largest possible completion up front
+        estimated = rate_limiter.count_tokens(prompt, self.model) + max_tokens
+        response = limiter.call(lambda: openai.ChatCompletion.create(**self.__request(prompt, temperature, max_tokens)),
+                                estimated)
+        _settle(limiter, estimated, response)
+        return response.choices[0].message.content.strip()
+
+    async def acomplete(self, prompt, temperature, max_tokens):
+        limiter = rate_limiter.get_limiter()
+        estimated = rate_limiter.count_tokens(prompt, self.model) + max_tokens
+        response = await limiter.acall(lambda: openai.ChatCompletion.acreate(**self.__request(prompt, temperature, max_tokens)),
+                                       estimated)
+        _settle(limiter, estimated, response)
+        return response.choices[0].message.content.strip()
+
+    def stream(self, prompt, temperature, max_tokens):
+        limiter = rate_limiter.get_limiter()
+        estimated = rate_limiter.count_tokens(prompt, self.model) + max_tokens
+        response = limiter.call(
+            lambda: openai.ChatCompletion.create(stream=True, **self.__request(prompt, temperature, max_tokens)), estimated)
+        received = []
+        try:
+            for chunk in response:
+                content = chunk.choices[0].delta.get("content")
+                if content:
+                    received.append(content)
+                    yield content
+        finally:
+            # streamed chunks carry no usage, count what arrived (also when the caller stops early)
+            _settle_stream(limiter, estimated, prompt, "".join(received), self.model)
+
+    def __request(self, prompt, temperature, max_tokens) -> dict:
+        return dict(
+            model=self.model,
+            messages=[{"role": "system", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            n=1,
+            stop=None,
+        )
+
+
+@register("openai_completion")
+class OpenAICompletionBackend(Backend):
+    def complete(self, prompt, temperature, max_tokens):
+        limiter = rate_limiter.get_limiter()
+        estimated = rate_limiter.count_tokens(prompt, self.model) + max_tokens
+        response = limiter.call(lambda: openai.Completion.create(**self.__request(prompt, temperature, max_tokens)),
+                                estimated)
+        _settle(limiter, estimated, response)
+        return response.choices[0].text.strip()
+
+    async def acomplete(self, prompt, temperature, max_tokens):
+        limiter = rate_limiter.get_limiter()
+        estimated = rate_limiter.count_tokens(prompt, self.model) + max_tokens
+        response = await limiter.acall(lambda: openai.Completion.acreate(**self.__request(prompt, temperature, max_tokens)),
+                                       estimated)
+        _settle(limiter, estimated, response)
+        return response.choices[0].text.strip()
+
+    def stream(self, prompt, temperature, max_tokens):
+        limiter = rate_limiter.get_limiter()
+        estimated = rate_limiter.count_tokens(prompt, self.model) + max_tokens
+        response = limiter.call(
+            lambda: openai.Completion.create(stream=True, **self.__request(prompt, temperature, max_tokens)), estimated)
+        received = []
+        try:
+            for chunk in response:
+                if chunk.choices[0].text:
+                    received.append(chunk.choices[0].text)
+                    yield chunk.choices[0].text
+        finally:
+            _settle_stream(limiter, estimated, prompt, "".join(received), self.model)
+
+    def __request(self, prompt, temperature, max_tokens) -> dict:
+        return dict(
+            engine=self.model,
+            prompt=prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=1,
+            frequency_penalty=0,
+            presence_penalty=0,
+        )
+
+
+@register("llama")
+class LlamaBackend(Backend):
+    """ one llama.cpp server per process loads the model once and serves every call """
+    def __init__(self, model, config):
+        super().__init__(model, config)
+        self.worker = llama_worker.get_worker(config.get("llama"))
+
+    def complete(self, prompt, temperature, max_tokens):
+        return self.worker.complete(prompt, temperature, max_tokens)
+
+    def stream(self, prompt, temperature, max_tokens):
+        return self.worker.stream(prompt, temperature, max_tokens)
+
+
+@register("mock")
+class MockBackend(Backend):
+    """ canned responses for the prompts of AgentGPTMEM, AgentPCMEM and Env
+    The same prompt always gets the same response. Configured by common.mock:
+        latency: seconds to wait per call (default 0), spread over the chunks when streaming
+        new_tasks: number of tasks created per result (default 3)
+        task_list: names the created tasks are drawn from
+        result: text of an executed task
+        embedding_dim: size of the embeddings (default 1536)
+    """
+    DEFAULT_TASK_LIST = [
+        "Research the background of the objective",
+        "List the main obstacles",
+        "Draft a step-by-step plan",
+        "Collect examples from experts",
+        "Summarize the findings",
+        "Review the plan for missing steps",
+    ]
+    DEFAULT_RESULT = "The task was completed. Key points: the approach works, the details are documented, and the next step is clear."
+
+    def __init__(self, model, config):
+        super().__init__(model, config)
+        mock = config.get("mock") or {}
+        self.latency = float(mock.get("latency", 0.0))
+        self.new_tasks = int(mock.get("new_tasks", 3))
+        self.task_list = list(mock.get("task_list", self.DEFAULT_TASK_LIST))
+        self.result = mock.get("result", self.DEFAULT_RESULT)
+        self.embedding_dim = int(mock.get("embedding_dim", 1536))
+        # size in bytes of every prompt, for benchmarks
+        self.prompt_bytes: List[int] = []
+
+    def complete(self, prompt, temperature, max_tokens):
+        self.prompt_bytes.append(len(prompt.encode("utf-8")))
+        if self.latency:
+            time.sleep(self.latency)
+        return self.respond(prompt)
+
+    async def acomplete(self, prompt, temperature, max_tokens):
+        self.prompt_bytes.append(len(prompt.encode("utf-8")))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.respond(prompt)
+
+    def stream(self, prompt, temperature, max_tokens):
+        self.prompt_bytes.append(len(prompt.encode("utf-8")))
+        words = re.findall(r"\S+\s*", self.respond(prompt)) or [""]
+        for word in words:
+            if self.latency:
+                time.sleep(self.latency / len(words))
+            yield word
+
+    def embed(self, texts, model):
+        # unit vectors seeded by the text: equal texts get equal embeddings
+        vectors = []
+        for text in texts:
+            rng = random.Random(hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest())
+            vector = [rng.gauss(0.0, 1.0) for _ in range(self.embedding_dim)]
+            norm = math.sqrt(sum(x * x for x in vector))
+            vectors.append([x / norm for x in vector])
+        return vectors
+
+    def respond(self, prompt: str) -> str:
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+        if "task prioritization AI" in prompt:
+            match = re.search(r"following tasks: (\[.*?\])\.\n", prompt, re.S)
+            try:
+                tasks = ast.literal_eval(match.group(1)) if match else []
+            except (ValueError, SyntaxError):
+                tasks = []
+            start = re.search(r"Start the task list with number (\d+)", prompt)
+            start = int(start.group(1)) if start else 1
+            return "\n".join(f"{start + i}. {task}" for i, task in enumerate(tasks))
+        if "task creation AI" in prompt and "create new tasks" in prompt:
+            return "\n".join(self.task_list[(seed + i) % len(self.task_list)] for i in range(self.new_tasks))
+        if "search finished tasks" in prompt:
+            return "\n".join(self.task_list[(seed + i) % len(self.task_list)] for i in range(2))
+        return f"{self.result} (#{seed % 1000})"
+
+
+def _settle(limiter, estimated, response):
+    usage = response.get("usage")
+    if usage and "total_tokens" in usage:
+        limiter.settle(estimated, usage["total_tokens"])
+
+
+def _settle_stream(limiter, estimated, prompt, received, model):
+    limiter.settle(estimated, rate_limiter.count_tokens(prompt, model) + rate_limiter.count_tokens(received, model))
+
+
+def backend_name(model: str, config: dict) -> str:
+    """ common.backend, or the backend serving the model """
+    name = config.get("backend")
+    if name:
+        assert name in BACKENDS, f"unknown backend {name}, choose from {list(BACKENDS)}"
+        return name
+    if model in BACKENDS:
+        return model
+    if model.startswith("llama"):
+        return "llama"
+    if model.startswith("gpt-"):
+        return "openai_chat"
+    return "openai_completion"
+
+
+_backend: Backend = OpenAIChatBackend("", {})
+
+
+def configure_from(common: dict) -> Backend:
+    """ select the process-wide backend from the `common` section of a config yaml """
+    global _backend
+    model = common.get("openai_model", "")
+    _backend = BACKENDS[backend_name(model, common)](model, common)
+    return _backend
+
+
+def get_backend() -> Backend:
+    return _backend
@@ -0,0 +1,92 @@
+"""
+Benchmark of the aagpt.py agent loop (agent.act -> env.exec -> agent.receive) on the
+deterministic mock LLM backend: steps/sec, prompt bytes per step and memory growth.
+
+    python benchmarks/bench_agent_loop.py [--world_root setup/game.yaml] [--life 256] [--latency 0] [--agent-type agent_localmem]
+
+The loop is the one of aagpt.main_loop without printing and the 1 second sleep.
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+import tracemalloc
+
+import yaml
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import backends
+import llm_cache
+import utils
+from agent import AgentGPTMEM, AgentPCMEM
+from env import Env
+
+
+def build_config(world_root: str, life: int, latency: float, agent_type: str) -> dict:
+    with open(world_root, "r") as f:
+        ws = yaml.load(f, Loader=yaml.FullLoader)
+    ws = copy.deepcopy(ws)
+    ws["common"]["backend"] = "mock"
+    ws["common"]["mock"] = dict(ws["common"].get("mock") or {}, latency=latency)
+    # every call must reach the backend
+    ws["common"]["llm_cache_mode"] = "off"
+    ws["agent"]["agent_type"] = agent_type
+    # local memory stays in this process
+    ws["agent"]["agent_memory_path"] = ""
+    ws["common"]["embedding_cache"] = ""
+    ws["agent"]["agent_life"] = life
+    return ws
+
+
+def run(ws: dict, report_every: int):
+    utils.common(ws)
+    assert llm_cache.get_cache().mode == "off"
+    backend = backends.get_backend()
+    agent = AgentGPTMEM(ws) if ws["agent"]["agent_type"] == "agent_gptmem" else AgentPCMEM(ws)
+    env = Env(ws)
+
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    steps, calls, reported = 0, 0, 0
+    start = time.perf_counter()
+    print(f"{'step':>6s} {'steps/s':>9s} {'prompt B/step':>14s} {'tasks':>6s} {'mem KiB':>9s}")
+    for time_step in range(1, agent.life + 1):
+        if not agent.task_list:
+            break
+        task = agent.act()
+        result = env.exec(agent, task)
+        agent.receive(result)
+        steps += 1
+        if steps % report_every == 0 or time_step == agent.life:
+            elapsed = time.perf_counter() - start
+            prompt_bytes = backend.prompt_bytes[calls:]
+            calls = len(backend.prompt_bytes)
+            current, _ = tracemalloc.get_traced_memory()
+            print(f"{steps:6d} {steps / elapsed:9.1f} {sum(prompt_bytes) / (steps - reported):14.0f} "
+                  f"{len(agent.task_list):6d} {(current - base) / 1024:9.1f}")
+            reported = steps
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    total_bytes = sum(backend.prompt_bytes)
+    print(f"steps={steps} steps/s={steps / elapsed:.1f} llm calls/step={len(backend.prompt_bytes) / max(steps, 1):.1f} "
+          f"prompt bytes/step={total_bytes / max(steps, 1):.0f} "
+          f"memory growth={(current - base) / 1024:.1f} KiB peak={(peak - base) / 1024:.1f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--world_root", type=str, default=os.path.join(ROOT, "setup", "game.yaml"))
+    parser.add_argument("--life", type=int, default=256, help="agent_life (number of steps)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per mock LLM call")
+    parser.add_argument("--agent-type", type=str, default="agent_gptmem", choices=["agent_gptmem", "agent_localmem"])
+    parser.add_argument("--report-every", type=int, default=32, help="print a row every N steps")
+    args = parser.parse_args()
+    run(build_config(args.world_root, args.life, args.latency, args.agent_type), args.report_every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Micro-benchmark: memory allocated per fetch/put_onto tick by get_dst_tuple + find_path.
+
+    python benchmarks/bench_dst_tuple.py [--ticks 1000]
+
+"before" reproduces the old get_dst_tuple, which deep-copied the level to open the
+destination cell; "after" is the current read-only version.
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from overcooked.env import PARTIAL_DEVIDER_SALAD_L, ITEM_LOCATIONS_L, get_dst_tuple
+from overcooked.utils import search
+
+
+def legacy_get_dst_tuple(item, level, item_locations):
+    destination = item_locations[item]
+    level = copy.deepcopy(level)
+    level[destination[0]][destination[1]] = 0
+    return destination, level
+
+
+def measure(name, get_dst, ticks, with_search):
+    level, item_locations, start = PARTIAL_DEVIDER_SALAD_L, ITEM_LOCATIONS_L, (1, 1)
+    items = list(item_locations.keys())
+    kept = []
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    peak = 0
+    elapsed = 0.0
+    for i in range(ticks):
+        item = items[i % len(items)]
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        destination, grid = get_dst(item, level, item_locations)
+        if with_search:
+            search(grid, 1, start, destination)
+        elapsed += time.perf_counter() - t0
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+        # keep the returned grids alive so every allocation they own shows up in the snapshot diff
+        kept.append(grid)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    print(f"{name:<28s} blocks/tick={blocks / ticks:8.2f}  peak bytes/tick={peak:8d}  us/tick={1e6 * elapsed / ticks:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ticks", type=int, default=1000)
+    args = parser.parse_args()
+    measure("before: get_dst_tuple", legacy_get_dst_tuple, args.ticks, with_search=False)
+    measure("after:  get_dst_tuple", get_dst_tuple, args.ticks, with_search=False)
+    measure("before: + search", legacy_get_dst_tuple, args.ticks, with_search=True)
+    measure("after:  + search", get_dst_tuple, args.ticks, with_search=True)
+
+
+if __name__ == "__main__":
+    main()
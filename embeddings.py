@@ -0,0 +1,130 @@
+from array import array
+from typing import Dict, List, Optional
+import hashlib
+import os
+import sqlite3
+import threading
+import backends
+
+
+"""
+Text embeddings with a content-hash cache.
+
+Vectors are cached in memory and in a SQLite file (float32 blobs), keyed by a
+hash of the backend, the embedding model and the text, so a text is only ever
+sent once. embed() looks up a whole batch at once and requests the missing
+texts in as few calls as possible (batch_size texts per request).
+"""
+
+
+class EmbeddingCache:
+    def __init__(self, path: Optional[str]=".embedding_cache.sqlite"):
+        """
+        Args:
+            path (str, optional): SQLite file, None keeps the cache in memory only. Defaults to ".embedding_cache.sqlite".
+        """
+        self.path = path
+        self.memory: Dict[str, List[float]] = {}
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self.db.commit()
+
+    @staticmethod
+    def key(backend: str, model: str, text: str) -> str:
+        # vectors of different backends (e.g. mock and OpenAI) must not mix
+        return hashlib.sha256(f"{backend}\0{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """ cached vectors of the keys that are cached """
+        found = {key: self.memory[key] for key in keys if key in self.memory}
+        missing = [key for key in keys if key not in found]
+        if self.db is not None and missing:
+            with self.lock:
+                # SQLite limits the number of parameters of a query
+                for i in range(0, len(missing), 500):
+                    chunk = missing[i:i + 500]
+                    rows = self.db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                                           chunk).fetchall()
+                    for key, blob in rows:
+                        vector = array("f")
+                        vector.frombytes(blob)
+                        found[key] = self.memory[key] = vector.tolist()
+        return found
+
+    def put_many(self, vectors: Dict[str, List[float]]):
+        self.memory.update(vectors)
+        if self.db is not None and vectors:
+            with self.lock:
+                self.db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                    [(key, array("f", vector).tobytes()) for key, vector in vectors.items()])
+                self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+class Embedder:
+    def __init__(self, model: str="text-embedding-ada-002", cache: Optional[EmbeddingCache]=None, batch_size: int=256):
+        """
+        Args:
+            model (str, optional): embedding model. Defaults to "text-embedding-ada-002".
+            cache (EmbeddingCache, optional): Defaults to an in-memory cache.
+            batch_size (int, optional): max texts per request. Defaults to 256.
+        """
+        self.model = model
+        self.cache = cache if cache is not None else EmbeddingCache(None)
+        self.batch_size = batch_size
+        # number of embedding requests sent and texts embedded by them
+        self.requests = 0
+        self.texts = 0
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """ embeddings of the texts, in order """
+        texts = [text.replace("\n", " ") for text in texts]
+        backend = backends.get_backend()
+        keys = [self.cache.key(backend.name, self.model, text) for text in texts]
+        found = self.cache.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing[key] = text
+        pending = list(missing.items())
+        for i in range(0, len(pending), self.batch_size):
+            batch = pending[i:i + self.batch_size]
+            vectors = backend.embed([text for _, text in batch], self.model)
+            self.requests += 1
+            self.texts += len(batch)
+            computed = {key: vector for (key, _), vector in zip(batch, vectors)}
+            self.cache.put_many(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_one(self, text: str) -> List[float]:
+        return self.embed([text])[0]
+
+
+_embedder = Embedder()
+
+
+def configure_from(common: dict) -> Embedder:
+    """ configure the process-wide embedder from the `common` section of a config yaml
+    common.embedding_model (default text-embedding-ada-002), common.embedding_cache
+    (SQLite file, default .embedding_cache.sqlite; empty keeps the cache in memory).
+    """
+    global _embedder
+    _embedder.cache.close()
+    path = common.get("embedding_cache", ".embedding_cache.sqlite")
+    _embedder = Embedder(common.get("embedding_model", "text-embedding-ada-002"), EmbeddingCache(path or None))
+    return _embedder
+
+
+def get_embedder() -> Embedder:
+    return _embedder
@@ -1,12 +1,25 @@
-from utils import openai_call
+from utils import openai_call, openai_call_stream
 
 
 class Env:
     def __init__(self, config):
         self.env_config = config["env"]
+        # stream the result of a task (env.stream), stopping early at env.stop_patterns or env.max_chars
+        self.stream = self.env_config.get("stream", False)
+        self.stop_patterns = self.env_config.get("stop_patterns")
+        self.max_chars = self.env_config.get("max_chars")
 
     def exec(self, agent, task):
         """Execute the given task using the agent and return the result."""
+        # Call the OpenAI API to get the result
+        return openai_call(self.prompt(agent, task), temperature=0.7, max_tokens=2000)
+
+    def exec_stream(self, agent, task):
+        """Execute the given task using the agent, yield the result in chunks as they arrive."""
+        return openai_call_stream(self.prompt(agent, task), temperature=0.7, max_tokens=2000,
+                                  stop_patterns=self.stop_patterns, max_chars=self.max_chars)
+
+    def prompt(self, agent, task):
         # Get the context of the top 5 related tasks from the agent's memory
         context = agent.context_search(5)
 
@@ -14,10 +27,7 @@ class Env:
         task = task["task_name"]
 
         # Prepare the prompt for the AI
-        prompt = f"""
+        return f"""
             You are an AI who performs one task based on the following objective: {agent.goal}\n.
             Take into account these previously completed tasks: {context}\n.
             Your task: {task}\nResponse:"""
-
-        # Call the OpenAI API to get the result
-        return openai_call(prompt, temperature=0.7, max_tokens=2000)
\ No newline at end of file
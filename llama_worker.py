@@ -0,0 +1,144 @@
+import atexit
+import json
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Iterator, Optional
+
+
+"""
+Long-lived llama.cpp inference worker.
+
+The llama.cpp HTTP server (`llama/server`, built with `make server`) is started
+once, loads the model weights once and serves every completion of the process
+over HTTP. Requests beyond the server's parallel slots wait in a queue here.
+Configured by common.llama in the config yaml:
+    server: path of the server binary (default llama/server)
+    model: model weights (default llama/models/7B/ggml-model.bin)
+    host, port: address to listen on (default 127.0.0.1:8080)
+    url: use an already running server instead of starting one
+    ctx_size, threads, parallel: passed to the server (-c, -t, --parallel)
+    startup_timeout: seconds to wait for the model to load (default 120)
+    request_timeout: seconds without an answer before a request fails (default 300)
+"""
+
+
+class LlamaWorker:
+    def __init__(self, config: Optional[dict]=None):
+        """
+        Args:
+            config (dict, optional): the common.llama section of the config yaml. Defaults to None.
+        """
+        config = config or {}
+        self.server = config.get("server", "llama/server")
+        self.model = config.get("model", "llama/models/7B/ggml-model.bin")
+        self.host = config.get("host", "127.0.0.1")
+        self.port = int(config.get("port", 8080))
+        self.url = _url(config)
+        self.ctx_size = int(config.get("ctx_size", 2048))
+        self.threads = config.get("threads")
+        self.parallel = int(config.get("parallel", 1))
+        self.startup_timeout = float(config.get("startup_timeout", 120))
+        # a hung server must not block the agent forever
+        self.request_timeout = float(config.get("request_timeout", 300))
+        self.external = bool(config.get("url"))
+        self.process = None
+        # at most `parallel` requests at the server, the others queue here
+        self.slots = threading.BoundedSemaphore(self.parallel)
+        self.lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def start(self):
+        """ launch the server (unless it is external) and wait until the model is loaded """
+        with self.lock:
+            if self.external or (self.process is not None and self.process.poll() is None):
+                return
+            cmd = [self.server, "-m", self.model, "--host", self.host, "--port", str(self.port),
+                   "-c", str(self.ctx_size), "--parallel", str(self.parallel)]
+            if self.threads:
+                cmd += ["-t", str(self.threads)]
+            self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.__wait_ready()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+    def complete(self, prompt: str, temperature: float=0.8, max_tokens: int=128) -> str:
+        """ completion of the prompt, starting the server on first use """
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        payload = {"prompt": prompt, "temperature": temperature, "n_predict": max_tokens}
+        with self.slots:
+            response = self.__post("/completion", payload)
+        return response.get("content", "").strip()
+
+    def stream(self, prompt: str, temperature: float=0.8, max_tokens: int=128) -> Iterator[str]:
+        """ chunks of the completion as the server generates them (server-sent events) """
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        payload = {"prompt": prompt, "temperature": temperature, "n_predict": max_tokens, "stream": True}
+        request = urllib.request.Request(self.url + "/completion", data=json.dumps(payload).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+        with self.slots, urllib.request.urlopen(request, timeout=self.request_timeout) as response:
+            for line in response:
+                line = line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                event = json.loads(line[len("data:"):])
+                if event.get("content"):
+                    yield event["content"]
+                if event.get("stop"):
+                    break
+
+    def __post(self, path: str, payload: dict) -> dict:
+        request = urllib.request.Request(self.url + path, data=json.dumps(payload).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.request_timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def __wait_ready(self):
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"llama.cpp server exited with code {self.process.returncode}: "
+                                   f"check common.llama.server ({self.server}) and model ({self.model})")
+            try:
+                # /health answers 503 while the model is loading
+                with urllib.request.urlopen(self.url + "/health", timeout=2) as response:
+                    if response.status == 200:
+                        return
+            except urllib.error.HTTPError as e:
+                # older servers have no /health; any HTTP answer other than "loading" means ready
+                if e.code == 404:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise TimeoutError(f"llama.cpp server did not start within {self.startup_timeout}s")
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def get_worker(config: Optional[dict]=None) -> LlamaWorker:
+    """ the process-wide worker for a common.llama config (one server per address) """
+    url = _url(config or {})
+    with _workers_lock:
+        # only the first config for an address builds a worker (and registers its exit handler)
+        if url not in _workers:
+            _workers[url] = LlamaWorker(config)
+        return _workers[url]
+
+
+def _url(config: dict) -> str:
+    return config.get("url") or f"http://{config.get('host', '127.0.0.1')}:{int(config.get('port', 8080))}"
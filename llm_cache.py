@@ -0,0 +1,163 @@
+from typing import List, Optional
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+"""
+Content-addressed cache of LLM responses in a SQLite file.
+
+A response is keyed by the model, the prompt (or chat messages), the sampling
+parameters and the number of choices. Modes:
+    off     the cache is not used
+    record  serve cached responses, ask the LLM on a miss and store its answer
+    replay  serve cached responses only, a miss raises CacheMiss (no network)
+Least recently used entries are evicted beyond max_entries or max_bytes.
+"""
+
+MODES = ("off", "record", "replay")
+
+
+class CacheMiss(KeyError):
+    """ a replay-mode lookup for a response that was never recorded """
+
+
+class LLMCache:
+    def __init__(self, path: str=".llm_cache.sqlite", mode: str="record",
+                 max_entries: int=100000, max_bytes: int=512 * 1024 * 1024):
+        """
+        Args:
+            path (str, optional): SQLite file. Defaults to ".llm_cache.sqlite".
+            mode (str, optional): one of MODES. Defaults to "record".
+            max_entries (int, optional): max number of cached responses. Defaults to 100000.
+            max_bytes (int, optional): max total size of the cached responses. Defaults to 512 MiB.
+        """
+        assert mode in MODES, f"unknown cache mode: {mode}"
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+        if mode != "off":
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                            "last_used REAL NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            self.db.commit()
+
+    @staticmethod
+    def key(model: str, prompt, temperature: Optional[float]=None, max_tokens: Optional[int]=None, n: int=1) -> str:
+        """
+        Args:
+            model (str): model name
+            prompt: prompt string or list of chat messages
+        """
+        payload = json.dumps([model, prompt, temperature, max_tokens, n], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """ cached responses for the key, or None """
+        if self.db is None:
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.db.commit()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, responses: List[str]):
+        if self.db is None or self.mode != "record":
+            return
+        value = json.dumps(responses)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO responses (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                            (key, value, len(value), time.time()))
+            self.__evict()
+            self.db.commit()
+
+    def lookup(self, key: str, compute) -> List[str]:
+        """ cached responses for the key, otherwise compute() (and record it)
+        Args:
+            compute: function returning the list of responses of a real LLM call
+        """
+        if self.db is None:
+            return compute()
+        responses = self.get(key)
+        if responses is not None:
+            return responses
+        if self.mode == "replay":
+            raise CacheMiss(f"no recorded LLM response in {self.path} (key {key[:12]})")
+        responses = compute()
+        self.put(key, responses)
+        return responses
+
+    async def alookup(self, key: str, compute) -> List[str]:
+        """ async version of lookup: compute() returns an awaitable """
+        if self.db is None:
+            return await compute()
+        responses = self.get(key)
+        if responses is not None:
+            return responses
+        if self.mode == "replay":
+            raise CacheMiss(f"no recorded LLM response in {self.path} (key {key[:12]})")
+        responses = await compute()
+        self.put(key, responses)
+        return responses
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __evict(self):
+        """ drop the least recently used responses beyond max_entries and max_bytes """
+        count, total = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        drop = []
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            drop.append((key,))
+            count -= 1
+            total -= size
+        self.db.executemany("DELETE FROM responses WHERE key = ?", drop)
+
+
+_cache = LLMCache(mode="off")
+
+
+def configure(path: str=".llm_cache.sqlite", mode: str="record", **kwargs) -> LLMCache:
+    """ replace the process-wide cache """
+    global _cache
+    _cache.close()
+    _cache = LLMCache(path, mode, **kwargs)
+    return _cache
+
+
+def configure_from(common: dict, path: Optional[str]=None, mode: Optional[str]=None) -> LLMCache:
+    """ configure the process-wide cache from the `common` section of a config yaml
+    Command line values (path, mode) take precedence over common.llm_cache / common.llm_cache_mode.
+    """
+    path = path or common.get("llm_cache")
+    mode = mode or common.get("llm_cache_mode") or ("record" if path else "off")
+    return configure(path or ".llm_cache.sqlite", mode)
+
+
+def get_cache() -> LLMCache:
+    return _cache
@@ -1,9 +1,15 @@
 from typing import List, Tuple
+import hashlib
 import os
+import time
 from overcooked.utils import *
 from overcooked.env import *
+from overcooked.navigation import NavigationCache
 from opencooking.utils.utils import *
 import openai
+import llm_cache
+import rate_limiter
+from rate_limiter import count_tokens
 
 
 # Reference:
@@ -14,6 +20,22 @@ class ChatBot:
             openai.api_key = config["common"]["openai_api_key"]
         self.model: str = config["common"]["openai_model"]
         self.messages: list = []
+        # tokens of each message in self.messages
+        self.message_tokens: list = []
+        # max prompt size: the prefix (system, instruction, one-shot example) is always
+        # sent, then as many of the most recent turns as fit
+        self.context_budget: int = getattr(arglist, "context_budget", None) or config["common"].get("context_budget", 3000)
+        # wall time and prompt size (tokens) of every completion request
+        self.latencies: list = []
+        self.prompt_tokens: list = []
+        # requests/min and tokens/min of the API key, shared by everything in this process
+        common = dict(config["common"])
+        for key in ("requests_per_minute", "tokens_per_minute"):
+            if getattr(arglist, key, None):
+                common[key] = getattr(arglist, key)
+        rate_limiter.configure_from(common)
+        self.cache = llm_cache.configure_from(config["common"], getattr(arglist, "llm_cache", None),
+                                              getattr(arglist, "llm_cache_mode", None))
 
         instruction, example = None, None
         self.num_agents: int = num_agents
@@ -28,72 +50,134 @@ class ChatBot:
         else:
             assert False, f"num_agents must be 1 or 2: {self.num_agents}"
 
-        self.messages.append({"role": "system", "content": "You are a Python programmer. Help me write code in Python."})
-        self.messages.append({"role": "user", "content": instruction})
+        # identifies the prompts a plan was generated with (see PlanCache)
+        self.prompt_digest: str = hashlib.sha256((instruction + example).encode("utf-8")).hexdigest()
+
+        self.append({"role": "system", "content": "You are a Python programmer. Help me write code in Python."})
+        self.append({"role": "user", "content": instruction})
 
         # one-shot learning
-        self.messages.append({
+        self.append({
             "role": "system",
             "name": "example_user",
             "content": "Make a lettuce salad."
         })
-        self.messages.append({"role": "system", "name": "example_assistant", "content": example})
+        self.append({"role": "system", "name": "example_assistant", "content": example})
+        self.prefix_len: int = len(self.messages)
 
     def __call__(self, message):
-        self.messages.append({"role": "user", "content": message})
-        result: str = self.execute()
-        print(result)
-        self.messages.append({"role": "assistant", "content": result})
+        result: str = self.sample(message, 1)[0]
+        logger.debug("%s", result)
+        self.accept(result)
         return result
 
+    def sample(self, message, n: int) -> List[str]:
+        """ send a user message and return n candidate replies from a single request
+        The replies are not added to the conversation; pass the chosen one to accept().
+        """
+        self.append({"role": "user", "content": message})
+        return self.execute_n(n)
+
+    def accept(self, response: str):
+        """ add the chosen reply to the conversation """
+        self.append({"role": "assistant", "content": response})
+
+    def append(self, message: dict):
+        self.messages.append(message)
+        # ~4 tokens of per-message overhead in the chat format
+        self.message_tokens.append(count_tokens(message["content"], self.model) + 4 + ("name" in message))
+
+    def window(self) -> Tuple[list, int]:
+        """ messages to send and their size in tokens
+        Keeps the prefix and the newest message, then adds earlier turns newest first
+        while they fit in the context budget. Omitted turns are replaced by a short note.
+        """
+        prefix = self.messages[:self.prefix_len]
+        size = sum(self.message_tokens[:self.prefix_len]) + 3
+        kept = []
+        i = len(self.messages) - 1
+        while i >= self.prefix_len:
+            tokens = self.message_tokens[i]
+            if kept and size + tokens > self.context_budget:
+                break
+            kept.append(self.messages[i])
+            size += tokens
+            i -= 1
+        omitted = i - self.prefix_len + 1
+        if omitted > 0:
+            note = {"role": "system", "content": f"({omitted} earlier messages of this conversation were omitted.)"}
+            size += count_tokens(note["content"], self.model) + 4
+            kept.append(note)
+        return prefix + kept[::-1], size
+
     def execute(self) -> str:
+        return self.execute_n(1)[0]
+
+    def execute_n(self, n: int) -> List[str]:
+        messages, size = self.window()
+        self.prompt_tokens.append(size)
+        logger.debug("ChatBot: sending %d of %d messages (%d tokens)", len(messages), len(self.messages), size)
+        start = time.perf_counter()
         try:
-            completion = openai.ChatCompletion.create(model=self.model, messages=self.messages)
-            #print(completion.usage) # number of tokens consumed
-            return completion.choices[0].message.content
+            return self.cache.lookup(self.cache.key(self.model, messages, n=n), lambda: self.__complete(messages, size, n))
+        except llm_cache.CacheMiss:
+            raise
         except Exception as e:
-            print(e)
-            return colors.RED + f"ERROR: {e}" + colors.ENDC
+            logger.error("%s", e)
+            return [colors.RED + f"ERROR: {e}" + colors.ENDC]
+        finally:
+            self.latencies.append(time.perf_counter() - start)
 
-
-class GPTWorld(World):
-    NAV_ACTIONS = [(0, 1), (0, -1), (-1, 0), (1, 0)]
-    def __init__(self, arglist):
-        super().__init__(arglist)
-
-    def get_gridsquare_list_at(self, location) -> list:
-        gss = list(filter(lambda o: o.location == location, self.get_object_list()))
-        assert len(gss) > 0, "{} gridsquares at {}: {}".format(len(gss), location, gss)
-        return gss
+    def __complete(self, messages: list, size: int, n: int) -> List[str]:
+        limiter = rate_limiter.get_limiter()
+        # the completion size is unknown; charge about as much as the prompt per reply
+        estimated = size * (1 + n)
+        completion = limiter.call(
+            lambda: openai.ChatCompletion.create(model=self.model, messages=messages, n=n), estimated)
+        if "usage" in completion:
+            limiter.settle(estimated, completion.usage["total_tokens"])
+        #print(completion.usage) # number of tokens consumed
+        return [choice.message.content for choice in completion.choices]
 
 
 class GPTAgent:
-    def __init__(self, id: int, level: str, arglist):
+    def __init__(self, id: int, level: str, arglist, item_locations: ItemRegistry=None):
+        """
+        Args:
+            item_locations (ItemRegistry, optional): registry shared with the other agents
+                of the same episode. Defaults to a fresh registry with the level's layout.
+        """
         assert 0 <= id <= 4
         self.id = id
         self.location = None
         self.on_hand = None
         self.level = None
-        self.item_locations = ITEM_LOCATIONS
+        default_locations = ITEM_LOCATIONS
         self.history = []
+        # shared ReservationTable: plan around the other agents instead of the static level only
+        self.reservations = None
         self.prev_state = None
         global g_max_steps
         if level == "open-divider_salad":
             self.level = OPEN_DIVIDER_SALAD
         elif level == "open-divider_salad_large":
             self.level = OPEN_DIVIDER_SALAD_L
-            self.item_locations = ITEM_LOCATIONS_L
+            default_locations = ITEM_LOCATIONS_L
             g_max_steps = 200
         elif level == "partial-divider_salad":
             self.level = PARTIAL_DEVIDER_SALAD
         elif level == "partial-divider_salad_large":
             self.level = PARTIAL_DEVIDER_SALAD_L
-            self.item_locations = ITEM_LOCATIONS_L
+            default_locations = ITEM_LOCATIONS_L
             g_max_steps = 200
         elif level == "full-divider_salad":
             self.level = FULL_DIVIDER_SALAD
         else:
             assert False, f"unknown level: {arglist.level}"
+        if item_locations is None:
+            item_locations = ItemRegistry(default_locations)
+        self.item_locations = item_locations
+        self.nav = NavigationCache(self.level, self.item_locations)
 
     def set_state(self, location: Tuple[int, int], action_str: str, action_loc: Tuple[int, int]):
         """ set the latest game state
@@ -124,12 +208,12 @@ class GPTAgent:
             elif ("merged plate" in description) and (self.on_hand is not None):
                 description = "put sliced " + ", ".join(self.on_hand) + " onto"
             description += ' ' + ", ".join(items)
-            print(colors.GREEN + f"agent{self.id}.set_state(): " + description + colors.ENDC)
+            logger.info(colors.GREEN + "agent%d.set_state(): %s" + colors.ENDC, self.id, description)
         self.history.append(description)
         if "picked" in description:
             # identify what item was picked up
-            for item in self.item_locations.keys():
-                if (item in description) and (item in MOVABLES):
+            for item in MOVABLES:
+                if item in description:
                     if self.on_hand is None:
                         self.on_hand = [item]
                     else:
@@ -137,13 +221,13 @@ class GPTAgent:
         elif ("put" in description) or ("merged" in description):
             if self.on_hand is not None:
                 # update the location of the item
-                for item in MOVABLES:
-                    for obj in self.on_hand:
-                        if item in obj:
-                            self.item_locations[item] = action_loc
+                for obj in self.on_hand:
+                    if obj in MOVABLES:
+                        self.item_locations.move(obj, action_loc)
+                        self.nav.invalidate(obj)
                 self.on_hand = None
         if self.on_hand is not None:
-            print(colors.YELLOW + f"agent{self.id}.on_hand = {self.on_hand}" + colors.ENDC)
+            logger.debug(colors.YELLOW + "agent%d.on_hand = %s" + colors.ENDC, self.id, self.on_hand)
         self.prev_state = (location, action_str, action_loc)
 
     def reset_state(self, reset_on_hand: bool=False):
@@ -166,14 +250,15 @@ class GPTAgent:
         """
         act = (0, 0)
         if not isinstance(destination, tuple):
-            print(colors.RED + f"ERROR: destination is not a tuple: {destination}" + colors.ENDC)
+            logger.error(colors.RED + "ERROR: destination is not a tuple: %s" + colors.ENDC, destination)
             return False, act
         if self.__has_reached(destination):
-            print(colors.YELLOW + f"agent{self.id}.move_to(): reached destination" + colors.ENDC)
+            logger.debug(colors.YELLOW + "agent%d.move_to(): reached destination" + colors.ENDC, self.id)
             return True, act
         dx = destination[0] - self.location[0]
         dy = destination[1] - self.location[1]
-        print(colors.YELLOW + f"agent{self.id}.move_to(): source={self.location}, destination={destination}, (dx, dy) = ({dx}, {dy})" + colors.ENDC)
+        logger.debug(colors.YELLOW + "agent%d.move_to(): source=%s, destination=%s, (dx, dy) = (%d, %d)" + colors.ENDC,
+                     self.id, self.location, destination, dx, dy)
         global g_keyboard
         if dx < 0:
             """
@@ -212,13 +297,13 @@ class GPTAgent:
             for obj in self.on_hand:
                 if item in obj:
                     return True, act  # item is already in hand
-        for key in self.item_locations.keys():
-            if item == key:
-                destination, level = get_dst_tuple(item, self.level, self.item_locations)
-                path: List[Tuple[int, int]] = find_path(self.location, destination, level)
-                print(colors.YELLOW + f"agent{self.id}.fetch(): path={path}" + colors.ENDC)
-                _, act = self.move_to(path[1])
-                break
+        if item in self.item_locations.keys():
+            next_hop = self.__next_hop(item)
+            logger.debug(colors.YELLOW + "agent%d.fetch(): next_hop=%s" + colors.ENDC, self.id, next_hop)
+            if next_hop is None:
+                logger.warning(colors.RED + "agent%d.fetch(): no path to %s" + colors.ENDC, self.id, item)
+                return False, act
+            _, act = self.move_to(next_hop)
         return False, act
 
     def put_onto(self, item) -> bool:
@@ -232,19 +317,20 @@ class GPTAgent:
         if self.on_hand is None:
             #print(colors.RED + f"GPTAgent.put_onto(): nothing in hand to put" + colors.ENDC)
             return True, act
-        destination, level = None, None
         if isinstance(item, str):
             if not(item in self.item_locations.keys()):
-                print(colors.RED + f"agent{self.id}.put_onto(): invalid item: {item}" + colors.ENDC)
+                logger.warning(colors.RED + "agent%d.put_onto(): invalid item: %s" + colors.ENDC, self.id, item)
                 return True, act
-            destination, level = get_dst_tuple(item, self.level, self.item_locations)
+            next_hop = self.__next_hop(item)
         elif isinstance(item, tuple):
-            pass #TODO: also accept 2D coordinate
+            next_hop = None #TODO: also accept 2D coordinate
         else:
             assert False, f"item must be str or Tuple[int, int]: {type(item)}"
-        path: List[Tuple[int, int]] = find_path(self.location, destination, level)
-        print(colors.YELLOW + f"agent{self.id}.put_onto(): path={path}" + colors.ENDC)
-        _, act = self.move_to(path[1])
+        logger.debug(colors.YELLOW + "agent%d.put_onto(): next_hop=%s" + colors.ENDC, self.id, next_hop)
+        if next_hop is None:
+            logger.warning(colors.RED + "agent%d.put_onto(): no path to %s" + colors.ENDC, self.id, item)
+            return False, act
+        _, act = self.move_to(next_hop)
         return False, act
 
     def slice_on(self, item: str) -> bool:
@@ -256,10 +342,10 @@ class GPTAgent:
         """
         act = (0, 0)
         if not(item in self.item_locations.keys()):
-            print(colors.RED + f"agent{self.id}.slice_on(): invalid item: {item}" + colors.ENDC)
+            logger.warning(colors.RED + "agent%d.slice_on(): invalid item: %s" + colors.ENDC, self.id, item)
             return True, act
         if not("cutboard" in item):
-            print(colors.RED + f"agent{self.id}.slice_on(): cannot slice on {item}" + colors.ENDC)
+            logger.warning(colors.RED + "agent%d.slice_on(): cannot slice on %s" + colors.ENDC, self.id, item)
             return True, act
         destination: Tuple[int, int] = self.item_locations[item]
         for description in self.history[::-1]:
@@ -286,5 +372,23 @@ class GPTAgent:
             return flag, (-1, 0)
         return flag, act
 
+    def __next_hop(self, item: str) -> Tuple[int, int]:
+        """ next cell towards the item
+        With a reservation table, plan a collision-free path over (x, y, t),
+        reserve it and return its first step (the current cell when waiting).
+        Falls back to the cached shortest path when no such path exists.
+        """
+        if self.reservations is None:
+            return self.nav.next_hop(item, self.location)
+        field = self.nav.field(item)
+        path = search_st(self.level, self.location, self.item_locations[item], self.reservations, self.id,
+                         heuristic=lambda x, y: field[x][y])
+        if len(path) < 2:
+            logger.debug(colors.YELLOW + "agent%d: no reservation-free path to %s" + colors.ENDC, self.id, item)
+            return self.nav.next_hop(item, self.location)
+        # the last step enters the item's cell as an interaction: keep the agent parked before it
+        self.reservations.reserve_path(self.id, path[:-1], self.reservations.now)
+        return path[1]
+
     def __has_reached(self, destination) -> bool:
         return (self.location[0] == destination[0]) and (self.location[1] == destination[1])
\ No newline at end of file
@@ -1,15 +1,18 @@
 from typing import Tuple, List
 import copy
+import logging
 import numpy as np
 from overcooked.utils import *
 from opencooking.utils.world import World
 from opencooking.utils.core import *
 from opencooking.misc.game.gameimage import GameImage
 from opencooking.envs.overcooked_environment import OvercookedEnvironment
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 
 
 CollisionRepr = namedtuple("CollisionRepr", "time agent_names agent_locations")
+# compact, immutable observation: t, ((agent name, location, holding), ...), ((object name, location, is_held), ...)
+ObservationRepr = namedtuple("ObservationRepr", "t agents objects")
 
 OPEN_DIVIDER_SALAD =   [[1, 1, 1, 1, 1, 1, 1],
                         [1, 0, 0, 0, 0, 0, 1],
@@ -99,8 +102,76 @@ ITEM_LOCATIONS_L = {
 
 MOVABLES = ["tomato", "lettuce", "plate0", "plate1"]
 
+SUPPORTED_LEVELS = ["open-divider_salad", "open-divider_salad_large",
+                    "partial-divider_salad", "partial-divider_salad_large",
+                    "full-divider_salad"]
+
+
+class ItemRegistry:
+    """ bidirectional item <-> location registry
+    Behaves like the item_locations dict (item -> (x, y)) and also answers
+    location -> items in O(1). move() updates both directions at once.
+    Each episode builds its own registry from the level's defaults, so the
+    ITEM_LOCATIONS constants are never mutated.
+    """
+    def __init__(self, item_locations: dict):
+        self.__locations = {}
+        self.__items_at = defaultdict(set)
+        # items at a location are reported in registration order
+        self.__order = {}
+        for item, location in item_locations.items():
+            self.__order[item] = len(self.__order)
+            self.move(item, location)
+
+    def move(self, item: str, location: Tuple[int, int]):
+        location = (location[0], location[1])
+        previous = self.__locations.get(item)
+        if previous is not None:
+            items = self.__items_at[previous]
+            items.discard(item)
+            if not items:
+                del self.__items_at[previous]
+        self.__order.setdefault(item, len(self.__order))
+        self.__locations[item] = location
+        self.__items_at[location].add(item)
+
+    def items_at(self, location: Tuple[int, int]) -> List[str]:
+        items = self.__items_at.get((location[0], location[1]))
+        if not items:
+            return []
+        return sorted(items, key=self.__order.__getitem__)
+
+    def copy(self):
+        return ItemRegistry(self.__locations)
+
+    def __getitem__(self, item: str) -> Tuple[int, int]:
+        return self.__locations[item]
+
+    def __setitem__(self, item: str, location: Tuple[int, int]):
+        self.move(item, location)
+
+    def __contains__(self, item) -> bool:
+        return item in self.__locations
+
+    def __iter__(self):
+        return iter(self.__locations)
+
+    def __len__(self) -> int:
+        return len(self.__locations)
+
+    def get(self, item: str, default=None):
+        return self.__locations.get(item, default)
+
+    def keys(self):
+        return self.__locations.keys()
+
+    def items(self):
+        return self.__locations.items()
+
 
 def identify_items_at(location: Tuple[int, int], item_locations: dict) -> List[str]:
+    if isinstance(item_locations, ItemRegistry):
+        return item_locations.items_at(location)
     result = []
     for item, loc in item_locations.items():
         if (loc[0] == location[0]) and (loc[1] == location[1]):
@@ -109,21 +180,108 @@ def identify_items_at(location: Tuple[int, int], item_locations: dict) -> List[s
 
 
 def get_dst_tuple(item: str, level: list, item_locations: dict) -> Tuple[Tuple[int, int], list]:
+    """ destination of the item and the grid to search it on
+    The level is returned as is (read-only): the pathfinder always treats the
+    destination cell as passable, so nothing is copied on the hot path.
+    """
     destination: Tuple[int, int] = item_locations[item]
-    level: list = copy.deepcopy(level)
-    level[destination[0]][destination[1]] = 0
     return destination, level
 
 
+class LazyImageObs:
+    """ image observation that is rasterized only when called
+    The frame reflects the state of the game at the time of the call, so it
+    should be read before the next env.step().
+    """
+    __slots__ = ("t", "__game", "__image")
+
+    def __init__(self, game, t: int):
+        self.t = t
+        self.__game = game
+        self.__image = None
+
+    def __call__(self):
+        if self.__image is None:
+            self.__image = self.__game.get_image_obs()
+        return self.__image
+
+
 class GPTWorld(World):
+    """ World with a location index for gridsquares and the objects resting on them
+    Held objects move with their agent and are not indexed. interact() keeps the
+    index up to date through place() and lift() whenever an object is put down
+    or picked up; insert() and remove() update it as well.
+    """
     NAV_ACTIONS = [(0, 1), (0, -1), (-1, 0), (1, 0)]
     def __init__(self, arglist):
         super().__init__(arglist)
+        self.__gridsquares = {}
+        self.__resting = defaultdict(list)
+
+    def copy(self):
+        new = super().copy()
+        new.rebuild_index()
+        return new
+
+    def rebuild_index(self):
+        self.__gridsquares = {}
+        self.__resting = defaultdict(list)
+        for obj in self.get_object_list():
+            self.__index(obj)
+
+    def insert(self, obj):
+        super().insert(obj)
+        self.__index(obj)
+
+    def remove(self, obj):
+        super().remove(obj)
+        self.lift(obj)
+
+    def place(self, obj):
+        """ index an object that was just put down at its location """
+        self.__resting[obj.location].append(obj)
+
+    def lift(self, obj):
+        """ unindex an object that is about to be picked up (or removed) """
+        objs = self.__resting.get(obj.location)
+        if objs is None:
+            return
+        for i, o in enumerate(objs):
+            if o is obj:
+                objs.pop(i)
+                break
+        if not objs:
+            del self.__resting[obj.location]
+
+    def is_occupied(self, location) -> bool:
+        return location in self.__resting
+
+    def get_object_at(self, location, desired_obj, find_held_objects):
+        if find_held_objects:
+            return super().get_object_at(location, desired_obj, find_held_objects)
+        objs = self.__resting.get(location, [])
+        if desired_obj is not None:
+            objs = [obj for obj in objs if obj.name == desired_obj.name]
+        assert len(objs) == 1, "looking for {}, found {} at {}".format(desired_obj, ','.join(o.get_name() for o in objs), location)
+        return objs[0]
+
+    def get_gridsquare_at(self, location):
+        gs = self.__gridsquares.get(location)
+        assert gs is not None, "0 gridsquares at {}".format(location)
+        return gs
 
     def get_gridsquare_list_at(self, location) -> list:
-        gss = list(filter(lambda o: o.location == location, self.get_object_list()))
+        """ the gridsquare at location followed by the objects resting on it """
+        gss = [self.__gridsquares[location]] if location in self.__gridsquares else []
+        gss += self.__resting.get(location, [])
         assert len(gss) > 0, "{} gridsquares at {}: {}".format(len(gss), location, gss)
         return gss
+
+    def __index(self, obj):
+        if isinstance(obj, GridSquare):
+            self.__gridsquares[obj.location] = obj
+        elif isinstance(obj, Object) and not obj.is_held:
+            self.place(obj)
     
 
 class OvercookedEnvGPT(OvercookedEnvironment):
@@ -146,11 +304,13 @@ class OvercookedEnvGPT(OvercookedEnvironment):
         self.load_level(
                 level=self.level,
                 num_agents=self.num_agents)
+        # load_level fills world.objects directly, bypassing insert()
+        self.world.rebuild_index()
         self.all_subtasks = self.run_recipes()
         self.world.make_loc_to_gridsquare()
         self.world.make_reachability_graph()
         self.cache_distances()
-        self.obs_tm1 = copy.copy(self)
+        self.obs_tm1 = self.observe()
 
         if self.arglist.record or self.arglist.with_image_obs:
             self.game = GameImage(
@@ -161,33 +321,34 @@ class OvercookedEnvGPT(OvercookedEnvironment):
             self.game.on_init()
             if self.arglist.record:
                 self.game.save_image_obs(self.t)
-        return copy.copy(self)
+        return self.observe()
     
     def step(self, action_dict):
         # Track internal environment info.
         self.t += 1
-        print("===============================")
-        print("[environment.step] @ TIMESTEP {}".format(self.t))
-        print("===============================")
+        logger.debug("===============================\n[environment.step] @ TIMESTEP %d\n===============================", self.t)
         # Get actions.
         for sim_agent in self.sim_agents:
             sim_agent.action = action_dict[sim_agent.name]
         # Check collisions.
         self.check_collisions()
-        self.obs_tm1 = copy.copy(self)
+        self.obs_tm1 = self.observe()
         # Execute.
         agents_states = self.execute_navigation()
         for agent_ in self.sim_agents:
             agents_states[agent_.name]['loc'] = agent_.location
         # Visualize.
-        self.display()
-        self.print_agents()
+        if logger.isEnabledFor(logging.DEBUG):
+            self.display()
+            self.print_agents()
         if self.arglist.record:
             self.game.save_image_obs(self.t)
         # Get a plan-representation observation.
-        new_obs = copy.copy(self)
-        # Get an image observation
-        image_obs = self.game.get_image_obs()
+        new_obs = self.observe()
+        # Get an image observation (rasterized on access, every frame_skip ticks)
+        image_obs = None
+        if self.arglist.with_image_obs and self.t % getattr(self.arglist, "frame_skip", 1) == 0:
+            image_obs = LazyImageObs(self.game, self.t)
 
         done = self.done()
         reward = self.reward()
@@ -196,6 +357,21 @@ class OvercookedEnvGPT(OvercookedEnvironment):
                 "done": done, "termination_info": self.termination_info, "agents_states": agents_states}
         return new_obs, reward, done, info
     
+    def observe(self):
+        """ observation of the current state
+        Returns:
+            ObservationRepr with only agent positions, holdings and object states,
+            or a full copy of the environment when arglist.full_obs_copy is set
+        """
+        if getattr(self.arglist, "full_obs_copy", False):
+            return copy.copy(self)
+        agents = tuple((agent.name, agent.location,
+                        None if agent.holding is None else agent.holding.full_name)
+                       for agent in self.sim_agents)
+        objects = tuple((obj.full_name, obj.location, obj.is_held)
+                        for obj in self.world.get_object_list() if isinstance(obj, Object))
+        return ObservationRepr(t=self.t, agents=agents, objects=objects)
+
     def execute_navigation(self):
         agents_states = {}
         for agent in self.sim_agents:
@@ -0,0 +1,57 @@
+from typing import Dict, List, Sequence, Tuple, Union
+import numpy as np
+
+
+Cell = Tuple[int, int]
+
+
+def distance_transform(level, sources: Sequence[Union[Cell, Sequence[Cell]]]) -> np.ndarray:
+    """ shortest-path distances from many sources at once by wavefront expansion
+    All sources are expanded together on a (K, W, H) boolean stack, so one BFS
+    layer costs a handful of array shifts no matter how many sources there are.
+    Args:
+        level: 2D grid indexed as level[x][y] (the transposed level arrays), cells that are not 0 are walls
+        sources: one entry per output channel, either a cell or a list of cells
+            (a multi-source channel measures the distance to the nearest of them).
+            Source cells are seeds even when they are walls, e.g. counters or supplies.
+    Returns:
+        np.ndarray: int32 array of shape (K, W, H), -1 where a channel's sources are unreachable
+    """
+    passable = np.asarray(level) == 0
+    no_rows, no_columns = passable.shape
+    num_sources = len(sources)
+    dist = np.full((num_sources, no_rows, no_columns), -1, dtype=np.int32)
+    frontier = np.zeros((num_sources, no_rows, no_columns), dtype=bool)
+    for k, source in enumerate(sources):
+        cells = [source] if np.ndim(source) == 1 else source
+        for x, y in cells:
+            frontier[k, x, y] = True
+    dist[frontier] = 0
+    visited = frontier.copy()
+    reached = np.empty_like(frontier)
+    d = 0
+    while frontier.any():
+        d += 1
+        reached[:] = False
+        reached[:, 1:, :] |= frontier[:, :-1, :]
+        reached[:, :-1, :] |= frontier[:, 1:, :]
+        reached[:, :, 1:] |= frontier[:, :, :-1]
+        reached[:, :, :-1] |= frontier[:, :, 1:]
+        reached &= passable
+        reached &= ~visited
+        dist[reached] = d
+        visited |= reached
+        frontier, reached = reached, frontier
+    return dist
+
+
+def item_distances(level, item_locations: Dict[str, Cell]) -> Tuple[List[str], np.ndarray]:
+    """ stacked distance fields for every item destination of a level
+    Args:
+        level: 2D grid indexed as level[x][y]
+        item_locations (Dict[str, Cell]): item name -> location
+    Returns:
+        Tuple[List[str], np.ndarray]: item names and the (K, W, H) distance tensor in the same order
+    """
+    names = list(item_locations.keys())
+    return names, distance_transform(level, [tuple(item_locations[name]) for name in names])
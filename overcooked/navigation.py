@@ -0,0 +1,74 @@
+from typing import Dict, List, Optional, Tuple
+from overcooked.grid_distance import distance_transform, item_distances
+
+
+# same move order as overcooked.utils.search: up, left, down, right
+MOVES = ((-1, 0), (0, -1), (1, 0), (0, 1))
+
+
+def distance_field(level, target: Tuple[int, int]) -> List[List[int]]:
+    """ BFS distance from every cell of the level to the target cell
+    Args:
+        level: 2D grid indexed as level[x][y], cells that are not 0 are walls
+        target (Tuple[int, int]): destination cell (may be a wall, e.g. a counter)
+    Returns:
+        List[List[int]]: dist[x][y] in steps, -1 where the target is unreachable
+    """
+    return distance_transform(level, [target])[0].tolist()
+
+
+class NavigationCache:
+    """ per-level distance fields for every item destination
+    The level is static, so the BFS field towards a cell never changes. Fields
+    are bound to item names; when a movable item changes location only the
+    binding of that item is dropped and rebuilt on the next lookup.
+    """
+    def __init__(self, level, item_locations: dict):
+        self.level = level
+        self.item_locations = item_locations
+        self.__fields_by_cell: Dict[Tuple[int, int], List[List[int]]] = {}
+        self.__bindings: Dict[str, Tuple[Tuple[int, int], List[List[int]]]] = {}
+        # build the fields of all current destinations in one stacked pass
+        names, dists = item_distances(self.level, self.item_locations)
+        for name, dist in zip(names, dists):
+            cell = tuple(self.item_locations[name])
+            dist = self.__fields_by_cell.setdefault(cell, dist.tolist())
+            self.__bindings[name] = (cell, dist)
+
+    def field(self, item: str) -> List[List[int]]:
+        """ distance field towards the current location of the item """
+        cell = tuple(self.item_locations[item])
+        binding = self.__bindings.get(item)
+        if binding is None or binding[0] != cell:
+            dist = self.__fields_by_cell.get(cell)
+            if dist is None:
+                dist = distance_field(self.level, cell)
+                self.__fields_by_cell[cell] = dist
+            binding = (cell, dist)
+            self.__bindings[item] = binding
+        return binding[1]
+
+    def invalidate(self, item: str):
+        """ drop the field bound to an item (e.g. after it was moved) """
+        self.__bindings.pop(item, None)
+
+    def distance(self, item: str, location: Tuple[int, int]) -> int:
+        """ number of steps from location to the item, -1 if unreachable """
+        return self.field(item)[location[0]][location[1]]
+
+    def next_hop(self, item: str, location: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        """ next cell on a shortest path from location towards the item
+        Returns:
+            Optional[Tuple[int, int]]: the next cell (the item's own cell when adjacent),
+                None when already there or the item is unreachable
+        """
+        dist = self.field(item)
+        x, y = location[0], location[1]
+        d = dist[x][y]
+        if d <= 0:
+            return None
+        for dx, dy in MOVES:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < len(dist) and 0 <= ny < len(dist[0]) and dist[nx][ny] == d - 1:
+                return (nx, ny)
+        return None
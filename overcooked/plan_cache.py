@@ -0,0 +1,68 @@
+from typing import Optional
+import hashlib
+import json
+import os
+
+
+class PlanCache:
+    """ on-disk cache of generated task_queue code
+    One JSON file per plan, keyed by model, level, task and a digest of the
+    instruction/example prompts. File modification times double as the LRU
+    order: a hit touches the file, and put() evicts the least recently used
+    plans beyond max_entries.
+    """
+    def __init__(self, root: str=".plan_cache", max_entries: int=256):
+        self.root = root
+        self.max_entries = max_entries
+        # lookups served from the cache
+        self.hits = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(model: str, level: str, task: str, prompt_digest: str) -> str:
+        payload = json.dumps([model, level, task, prompt_digest])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """ cached code for the key, or None """
+        path = self.__path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        code = entry.get("code")
+        if code is not None:
+            self.hits += 1
+        return code
+
+    def put(self, key: str, code: str, **metadata):
+        entry = dict(metadata, code=code)
+        path = self.__path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """ drop the least recently used plans beyond max_entries """
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        entries.sort()
+        for _, path in entries[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.root, key + ".json")
@@ -0,0 +1,186 @@
+from typing import Dict, List, Optional, Tuple
+from collections import namedtuple
+from overcooked.grid_distance import distance_transform
+from overcooked.navigation import NavigationCache
+
+
+"""
+Offline cost model of a task_queue: walks the fetch/put_onto/slice_on/deliver
+subtasks over the level grid with shortest-path distances, the way GPTAgent
+and the main loop in aagpt-overcooked.py would execute them, without
+instantiating the opencooking world. Collisions between agents are ignored,
+so the step count is a lower bound for the real episode.
+"""
+
+# steps: predicted score of the main loop (global_steps), counting the initial env.step
+# feasible: False when a subtask would never finish
+# issues: one message per problem found
+# ticks: ticks spent on each subtask that was simulated
+PlanEstimate = namedtuple("PlanEstimate", "steps feasible issues ticks")
+
+FOODS = ("tomato", "lettuce")
+
+
+def _subtask_spec(subtask) -> Tuple[int, str, object]:
+    """ (agent id, function name, argument) of a task_queue entry """
+    f, arg = subtask[0], subtask[1]
+    agent = getattr(f, "__self__", None)
+    if agent is None:
+        raise ValueError(f"not a GPTAgent method: {f}")
+    return agent.id, f.__name__, arg
+
+
+class _AgentState:
+    def __init__(self, location: Tuple[int, int]):
+        self.location = location
+        self.on_hand: List[str] = []
+        # ("put", item) and ("sliced", item) events, as seen by GPTAgent.slice_on
+        self.history: List[Tuple[str, str]] = []
+
+
+class PlanSimulator:
+    """ predicts the number of ticks a task_queue takes on a level """
+    def __init__(self, level, item_locations: dict):
+        self.level = level
+        self.initial_locations = {item: tuple(loc) for item, loc in item_locations.items()}
+        self.nav = NavigationCache(level, dict(self.initial_locations))
+        self.__cell_fields: Dict[Tuple[int, int], list] = {}
+
+    def simulate(self, task_queue: list, start_locations: Dict[int, Tuple[int, int]]) -> PlanEstimate:
+        """
+        Args:
+            task_queue (list): (agent method, argument) tuples as generated by the LLM
+            start_locations (Dict[int, Tuple[int, int]]): agent id -> location before the first subtask
+        Returns:
+            PlanEstimate
+        """
+        item_locations = dict(self.initial_locations)
+        self.nav.item_locations = item_locations
+        agents = {agent_id: _AgentState(tuple(loc)) for agent_id, loc in start_locations.items()}
+        sliced = set()
+        delivered = set()
+        issues, ticks = [], []
+        for i, subtask in enumerate(task_queue):
+            try:
+                agent_id, name, arg = _subtask_spec(subtask)
+            except (TypeError, IndexError, ValueError) as e:
+                issues.append(f"#{i}: invalid subtask: {e}")
+                return PlanEstimate(1 + sum(ticks), False, issues, ticks)
+            agent = agents.get(agent_id)
+            if agent is None:
+                issues.append(f"#{i}: no start location for agent{agent_id}")
+                return PlanEstimate(1 + sum(ticks), False, issues, ticks)
+            op = getattr(self, "_" + name, None)
+            if op is None:
+                issues.append(f"#{i}: unknown function {name}")
+                return PlanEstimate(1 + sum(ticks), False, issues, ticks)
+            cost, error = op(agent, arg, item_locations, sliced, delivered)
+            if error is not None:
+                issues.append(f"#{i}: agent{agent_id}.{name}({arg}): {error}")
+                return PlanEstimate(1 + sum(ticks), False, issues, ticks)
+            ticks.append(cost)
+        if not delivered:
+            issues.append("nothing is delivered")
+        return PlanEstimate(1 + sum(ticks), True, issues, ticks)
+
+    def _fetch(self, agent, item, item_locations, sliced, delivered):
+        if item in agent.on_hand:
+            return 1, None
+        if item not in item_locations:
+            return None, "unknown item"
+        if agent.on_hand:
+            return None, f"hands are full ({', '.join(agent.on_hand)})"
+        cell = item_locations[item]
+        movables = [name for name, loc in item_locations.items() if loc == cell and self.__is_movable(name)]
+        if not movables:
+            return None, "nothing to pick up"
+        d = self.__walk(agent, item)
+        if d is None:
+            return None, "unreachable"
+        agent.on_hand = movables
+        # d - 1 moves, the pick up, then one tick for set_state to see it
+        return d + 1, None
+
+    def _put_onto(self, agent, item, item_locations, sliced, delivered):
+        if not agent.on_hand:
+            return 1, None
+        if item not in item_locations:
+            return None, "unknown item"
+        d = self.__walk(agent, item)
+        if d is None:
+            return None, "unreachable"
+        cell = item_locations[item]
+        for obj in agent.on_hand:
+            item_locations[obj] = cell
+        agent.on_hand = []
+        agent.history.append(("put", item))
+        return d + 1, None
+
+    def _slice_on(self, agent, item, item_locations, sliced, delivered):
+        if item not in item_locations or "cutboard" not in item:
+            return None, "not a cutboard"
+        for event, name in agent.history[::-1]:
+            if event == "put" and name == item:
+                cell = item_locations[item]
+                foods = [obj for obj, loc in item_locations.items() if loc == cell and obj in FOODS]
+                if not foods:
+                    return None, "no food on the cutboard"
+                d = self.__walk(agent, item)
+                if d is None:
+                    return None, "unreachable"
+                sliced.update(foods)
+                agent.history.append(("sliced", item))
+                # d - 1 moves, the chop, then one tick to see it in the history
+                return d + 1, None
+            elif event == "sliced":
+                return 1, None
+        return None, "nothing was put onto the cutboard"
+
+    def _deliver(self, agent, dummy, item_locations, sliced, delivered):
+        if "star" not in item_locations:
+            return None, "no delivery location"
+        foods = [obj for obj in agent.on_hand if obj in FOODS]
+        if not any(obj.startswith("plate") for obj in agent.on_hand) or not foods:
+            return None, "nothing deliverable in hand"
+        if not all(obj in sliced for obj in foods):
+            return None, "food is not sliced"
+        star = item_locations["star"]
+        destination = (star[0] + 1, star[1])
+        d = self.__cell_field(destination)[agent.location[0]][agent.location[1]]
+        if d < 0:
+            return None, "unreachable"
+        agent.location = destination
+        for obj in agent.on_hand:
+            item_locations.pop(obj, None)
+            delivered.add(obj)
+        agent.on_hand = []
+        # d moves, then the delivery on the tick the destination is reached
+        return d + 1, None
+
+    def __walk(self, agent, item) -> Optional[int]:
+        """ move the agent next to the item, return the distance to the item's cell """
+        d = self.nav.distance(item, agent.location)
+        if d < 0:
+            return None
+        location = agent.location
+        for _ in range(d - 1):
+            location = self.nav.next_hop(item, location)
+        agent.location = location
+        return d
+
+    def __cell_field(self, cell: Tuple[int, int]) -> list:
+        field = self.__cell_fields.get(cell)
+        if field is None:
+            field = distance_transform(self.level, [cell])[0].tolist()
+            self.__cell_fields[cell] = field
+        return field
+
+    @staticmethod
+    def __is_movable(name: str) -> bool:
+        return name in FOODS or name.startswith("plate")
+
+
+def simulate_plan(task_queue: list, level, item_locations: dict,
+                  start_locations: Dict[int, Tuple[int, int]]) -> PlanEstimate:
+    """ predict the score (global steps) of a task_queue, see PlanSimulator """
+    return PlanSimulator(level, item_locations).simulate(task_queue, start_locations)
@@ -0,0 +1,112 @@
+from typing import Dict, List, Optional, Set
+from overcooked.env import MOVABLES
+
+
+"""
+Dependency-aware scheduling of a task_queue for several agents.
+
+Each subtask touches a set of resources: the item it names, the place that
+item currently sits on (a counter, cutboard or plate) with everything else
+on it, and whatever its agent is carrying. A subtask depends on the previous
+subtask of the same agent and on every earlier subtask of another agent that
+touches a common resource. Independent subtasks of different agents can then
+run in the same env.step.
+"""
+
+
+def _owner(subtask) -> int:
+    return subtask[0].__self__.id
+
+
+def infer_dependencies(task_queue: list) -> List[Set[int]]:
+    """ indices of the earlier subtasks each subtask must wait for """
+    # where each movable item sits: the name of a place, or ("hand", agent id)
+    place: Dict[str, object] = {item: item for item in MOVABLES}
+    carried: Dict[int, Set[str]] = {}
+
+    def place_of(name):
+        return place.get(name, name)
+
+    def stack_at(location) -> Set[str]:
+        return {item for item, loc in place.items() if loc == location}
+
+    touched: List[Set[str]] = []
+    for subtask in task_queue:
+        f, arg = subtask[0], subtask[1]
+        agent_id = _owner(subtask)
+        hand = carried.setdefault(agent_id, set())
+        op = f.__name__
+        if op == "fetch":
+            location = place_of(arg)
+            stack = stack_at(location) | {arg}
+            if not isinstance(location, tuple):
+                stack.add(location)
+            resources = stack | hand
+            for item in stack:
+                if item in place:
+                    place[item] = ("hand", agent_id)
+                    hand.add(item)
+        elif op == "put_onto":
+            location = place_of(arg)
+            resources = {arg} | stack_at(location) | hand
+            if not isinstance(location, tuple):
+                resources.add(location)
+            for item in hand:
+                place[item] = location
+            hand.clear()
+        elif op == "slice_on":
+            location = place_of(arg)
+            resources = {arg} | stack_at(location)
+        elif op == "deliver":
+            resources = {"star"} | hand
+            for item in hand:
+                place[item] = "star"
+            hand.clear()
+        else:
+            resources = {str(arg)} | hand
+        touched.append(resources)
+
+    deps: List[Set[int]] = []
+    last_of_agent: Dict[int, int] = {}
+    for j, subtask in enumerate(task_queue):
+        agent_id = _owner(subtask)
+        dep = set()
+        if agent_id in last_of_agent:
+            dep.add(last_of_agent[agent_id])
+        for i in range(j):
+            if _owner(task_queue[i]) != agent_id and touched[i] & touched[j]:
+                dep.add(i)
+        deps.append(dep)
+        last_of_agent[agent_id] = j
+    return deps
+
+
+class TaskScheduler:
+    """ hands every agent its next subtask once the subtasks it depends on are done """
+    def __init__(self, task_queue: list):
+        self.task_queue = task_queue
+        self.deps = infer_dependencies(task_queue)
+        self.done = [False] * len(task_queue)
+        self.__pending: Dict[int, List[int]] = {}
+        for i, subtask in enumerate(task_queue):
+            self.__pending.setdefault(_owner(subtask), []).append(i)
+
+    def next_for(self, agent_id: int) -> Optional[int]:
+        """ index of the agent's next subtask if it is ready to run, else None """
+        pending = self.__pending.get(agent_id)
+        if not pending:
+            return None
+        i = pending[0]
+        if all(self.done[d] for d in self.deps[i]):
+            return i
+        return None
+
+    def complete(self, i: int):
+        self.done[i] = True
+        pending = self.__pending[_owner(self.task_queue[i])]
+        if pending and pending[0] == i:
+            pending.pop(0)
+
+    @property
+    def finished(self) -> bool:
+        return all(self.done)
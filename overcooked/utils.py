@@ -1,6 +1,9 @@
 import numpy as np
 from typing import Tuple, List
+import heapq
+import logging
 import random
+import sys
 import re
 from opencooking.utils.core import *
 from opencooking.utils.utils import *
@@ -14,6 +17,25 @@ class colors:
     BLUE = "\033[34m"
 
 
+# Per-tick output (environment banner, grids, paths, moves) is logged at DEBUG,
+# task progress at INFO and problems at WARNING or above. Messages use lazy
+# %-formatting so nothing is formatted when the level is disabled.
+logger = logging.getLogger("overcooked")
+
+
+def setup_logging(quiet: bool=False):
+    """ send overcooked logs to stdout
+    Args:
+        quiet (bool, optional): only show warnings and errors. Defaults to False.
+    """
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(logging.WARNING if quiet else logging.DEBUG)
+
+
 def fix_seed(seed):
     np.random.seed(seed)
     random.seed(seed)
@@ -34,6 +56,8 @@ def interact(agent, world) -> Tuple[str, Tuple[int, int]]:
     """Carries out interaction for this agent taking this action in this world.
 
     The action that needs to be executed is stored in `agent.action`.
+    `world` must be a GPTWorld: objects put down or picked up are reported to
+    its location index through world.place() / world.lift().
     """
 
     action_str = None
@@ -43,7 +67,7 @@ def interact(agent, world) -> Tuple[str, Tuple[int, int]]:
     if agent.action == (0, 0):
         return action_str, action_loc
 
-    action_loc = world.inbounds(tuple(np.asarray(agent.location) + np.asarray(agent.action)))
+    action_loc = world.inbounds((agent.location[0] + agent.action[0], agent.location[1] + agent.action[1]))
     gs = world.get_gridsquare_at(action_loc)
 
     # if floor in front --> move to that square
@@ -64,7 +88,8 @@ def interact(agent, world) -> Tuple[str, Tuple[int, int]]:
                 action_str = f"delivered {__extract_object_names(str(obj.contents))} at"
                 gs.acquire(obj)
                 agent.release()
-                print('\nDelivered {}!'.format(obj.full_name))
+                world.place(obj)
+                logger.info('\nDelivered %s!', obj.full_name)
 
         # if occupied gridsquare in front --> try merging
         elif world.is_occupied(gs.location):
@@ -82,8 +107,10 @@ def interact(agent, world) -> Tuple[str, Tuple[int, int]]:
                 # if playable version, merge onto counter first
                 if world.arglist.gpt:
                     # --gpt
-                    gs.acquire(agent.holding)
+                    merged = agent.holding
+                    gs.acquire(merged)
                     agent.release()
+                    world.place(merged)
 
         # if holding something, empty gridsquare in front --> chop or drop
         elif not world.is_occupied(gs.location):
@@ -98,6 +125,7 @@ def interact(agent, world) -> Tuple[str, Tuple[int, int]]:
                 action_str = f"put {__extract_object_names(str(obj.contents))} onto"
                 gs.acquire(obj) # obj is put onto gridsquare
                 agent.release()
+                world.place(obj)
                 assert world.get_object_at(gs.location, obj, find_held_objects =\
                     False).is_held == False, "Verifying put down works"
 
@@ -115,6 +143,7 @@ def interact(agent, world) -> Tuple[str, Tuple[int, int]]:
                 obj.chop()
             else:
                 action_str = f"picked up {__extract_object_names(str(obj.contents))}"
+                world.lift(obj)
                 gs.release()
                 agent.acquire(obj)
 
@@ -125,209 +154,215 @@ def interact(agent, world) -> Tuple[str, Tuple[int, int]]:
     return action_str, action_loc
 
 
-def index_2d(data, search):
-    for i, e in enumerate(data):
-        try:
-            return i, e.index(search)
-        except ValueError:
-            pass
-    raise ValueError("{!r} is not in list".format(search))
-
-
-def find_path(start: Tuple[int, int], end: Tuple[int, int], level: list, cost: int=1) -> List[Tuple[int, int]]:
-    path = search(level, cost, start, end)
-    #print(path, type(path))
-    print('\n'.join([''.join([colors.GREEN + "{:" ">3d}".format(item) + colors.ENDC if item >=0 else\
-                               "{:" ">3d}".format(item) for item in row]) for row in np.transpose(path)]))
-    result = []
-    i = 0
-    while True:
-        try:
-            position = index_2d(path, i)
-        except ValueError:
-            break
-        result.append(position)
-        i += 1
-    return result
-
-
-# Reference:
-# https://github.com/BaijayantaRoy/Medium-Article/blob/master/A_Star.ipynb
-class Node:
-    """
-        A node class for A* Pathfinding
-        parent is parent of the current Node
-        position is current position of the Node in the maze
-        g is cost from start to current Node
-        h is heuristic based estimated cost for current Node to end Node
-        f is total cost of present node i.e. :  f = g + h
-    """
+def __format_path(path: List[Tuple[int, int]], shape: Tuple[int, int]) -> str:
+    no_rows, no_columns = shape
+    steps = {position: i for i, position in enumerate(path)}
+    lines = []
+    for y in range(no_columns):
+        line = ""
+        for x in range(no_rows):
+            step = steps.get((x, y), -1)
+            if step >= 0:
+                line += colors.GREEN + "{:>3d}".format(step) + colors.ENDC
+            else:
+                line += "{:>3d}".format(step)
+        lines.append(line)
+    return "\n".join(lines)
 
-    def __init__(self, parent=None, position=None):
-        self.parent = parent
-        self.position = position
 
-        self.g = 0
-        self.h = 0
-        self.f = 0
-    def __eq__(self, other):
-        return self.position == other.position
+def find_path(start: Tuple[int, int], end: Tuple[int, int], level: list, cost: int=1, unblocked: frozenset=frozenset()) -> List[Tuple[int, int]]:
+    path = search(level, cost, start, end, unblocked)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(__format_path(path, np.shape(level)))
+    return path
 
 
-#This function return the path of the search
-def return_path(current_node,maze):
-    path = []
-    no_rows, no_columns = np.shape(maze)
-    # here we create the initialized result maze with -1 in every position
-    result = [[-1 for i in range(no_columns)] for j in range(no_rows)]
-    current = current_node
-    while current is not None:
-        path.append(current.position)
-        current = current.parent
-    # Return reversed path as we need to show from start to end path
-    path = path[::-1]
-    start_value = 0
-    # we update the path of start to end found by A-star serch with every step incremented by 1
-    for i in range(len(path)):
-        result[path[i][0]][path[i][1]] = start_value
-        start_value += 1
-    return result
-
-
-def search(maze, cost, start, end):
+def search(maze, cost, start, end, unblocked=frozenset()) -> List[Tuple[int, int]]:
     """
-        Returns a list of tuples as a path from the given start to the given end in the given maze
-        :param maze:
-        :param cost
+        A* search over a 4-connected grid.
+        Cells whose value is not 0 are walls, except the end cell and the cells in
+        `unblocked`, so a read-only level can be searched without copying it.
+        Open nodes are kept in a binary heap, g costs and the closed set are flat
+        arrays indexed by x * no_columns + y, and the heuristic is the Manhattan
+        distance (admissible for 4-way moves).
+        :param maze: 2D grid indexed as maze[x][y]
+        :param cost: cost of a single move
         :param start:
         :param end:
-        :return:
+        :param unblocked: extra cells to treat as walkable
+        :return: list of positions from start to end (both included), or [] if unreachable
     """
+    no_rows, no_columns = np.shape(maze)
+    sx, sy = int(start[0]), int(start[1])
+    ex, ey = int(end[0]), int(end[1])
+    if not (0 <= ex < no_rows and 0 <= ey < no_columns):
+        return []
+    start_index = sx * no_columns + sy
+    end_index = ex * no_columns + ey
+
+    g = [float("inf")] * (no_rows * no_columns)
+    parent = [-1] * (no_rows * no_columns)
+    closed = bytearray(no_rows * no_columns)
+
+    g[start_index] = 0
+    # (f, h, tie-breaker, index): on equal f prefer nodes closer to the goal
+    heap = [(cost * (abs(sx - ex) + abs(sy - ey)), 0, 0, start_index)]
+    counter = 1
+
+    while heap:
+        _, _, _, index = heapq.heappop(heap)
+        if closed[index]:
+            continue
+        if index == end_index:
+            path = []
+            while index != -1:
+                path.append(divmod(index, no_columns))
+                index = parent[index]
+            return path[::-1]
+        closed[index] = 1
+        x, y = divmod(index, no_columns)
+        child_g = g[index] + cost
+        for dx, dy in ((-1, 0), (0, -1), (1, 0), (0, 1)):
+            nx, ny = x + dx, y + dy
+            if nx < 0 or nx >= no_rows or ny < 0 or ny >= no_columns:
+                continue
+            child = nx * no_columns + ny
+            if maze[nx][ny] != 0 and child != end_index and (nx, ny) not in unblocked:
+                continue
+            if closed[child] or child_g >= g[child]:
+                continue
+            g[child] = child_g
+            parent[child] = index
+            h = cost * (abs(nx - ex) + abs(ny - ey))
+            heapq.heappush(heap, (child_g + h, h, counter, child))
+            counter += 1
+    return []
 
-    # Create start and end node with initized values for g, h and f
-    start_node = Node(None, tuple(start))
-    start_node.g = start_node.h = start_node.f = 0
-    end_node = Node(None, tuple(end))
-    end_node.g = end_node.h = end_node.f = 0
-
-    # Initialize both yet_to_visit and visited list
-    # in this list we will put all node that are yet_to_visit for exploration.
-    # From here we will find the lowest cost node to expand next
-    yet_to_visit_list = []
-    # in this list we will put all node those already explored so that we don't explore it again
-    visited_list = []
-
-    # Add the start node
-    yet_to_visit_list.append(start_node)
-
-    # Adding a stop condition. This is to avoid any infinite loop and stop
-    # execution after some reasonable number of steps
-    outer_iterations = 0
-    max_iterations = (len(maze) // 2) ** 10
-
-    # what squares do we search . serarch movement is left-right-top-bottom
-    #(4 movements) from every positon
 
-    move  =  [[-1, 0 ], # go up
-              [ 0, -1], # go left
-              [ 1, 0 ], # go down
-              [ 0, 1 ]] # go right
+class ReservationTable:
+    """
+        Cells and moves claimed by agents over time, shared by cooperating agents.
+        Every tick starts with begin_tick(): all previous plans are dropped and each
+        agent is parked at its current location (blocked for every t >= now).
+        An agent that plans afterwards reserves its path with reserve_path(), so
+        agents planning later in the same tick route around it.
+    """
 
+    def __init__(self):
+        self.now = 0
+        self.__cells = {}   # (x, y, t) -> agent id
+        self.__moves = {}   # ((x0, y0), (x1, y1), t) -> agent id, for a move ending at t
+        self.__parked = {}  # (x, y) -> (agent id, from t)
+
+    def begin_tick(self, t: int, locations: dict):
+        """
+            :param t: current timestep
+            :param locations: agent id -> current location
+        """
+        self.now = t
+        self.__cells = {}
+        self.__moves = {}
+        self.__parked = {}
+        for agent_id, location in locations.items():
+            self.park(agent_id, location, t)
+
+    def park(self, agent_id, location, t: int):
+        self.__parked[(location[0], location[1])] = (agent_id, t)
+
+    def release(self, agent_id):
+        """ drop every reservation of the agent """
+        self.__cells = {k: v for k, v in self.__cells.items() if v != agent_id}
+        self.__moves = {k: v for k, v in self.__moves.items() if v != agent_id}
+        self.__parked = {k: v for k, v in self.__parked.items() if v[0] != agent_id}
+
+    def reserve_path(self, agent_id, path: List[Tuple[int, int]], t0: int, park: bool=True):
+        """
+            Reserve path[k] at time t0 + k and the moves between them, then park
+            the agent on the last cell (unless park is False).
+        """
+        self.release(agent_id)
+        for k, cell in enumerate(path):
+            self.__cells[(cell[0], cell[1], t0 + k)] = agent_id
+            if k > 0:
+                self.__moves[(tuple(path[k - 1]), tuple(cell), t0 + k)] = agent_id
+        if park and path:
+            self.park(agent_id, path[-1], t0 + len(path) - 1)
+
+    def is_free(self, agent_id, cell, t: int) -> bool:
+        owner = self.__cells.get((cell[0], cell[1], t))
+        if owner is not None and owner != agent_id:
+            return False
+        parked = self.__parked.get((cell[0], cell[1]))
+        return parked is None or parked[0] == agent_id or t < parked[1]
+
+    def is_move_free(self, agent_id, src, dst, t: int) -> bool:
+        """ False if another agent swaps places with us between t - 1 and t """
+        owner = self.__moves.get((tuple(dst), tuple(src), t))
+        return owner is None or owner == agent_id
+
+
+def search_st(maze, start, end, reservations: ReservationTable, agent_id, t0: int=None,
+              heuristic=None, horizon: int=None) -> List[Tuple[int, int]]:
     """
-        1) We first get the current node by comparing all f cost and selecting the lowest cost node for further expansion
-        2) Check max iteration reached or not . Set a message and stop execution
-        3) Remove the selected node from yet_to_visit list and add this node to visited list
-        4) Perofmr Goal test and return the path else perform below steps
-        5) For selected node find out all children (use move to find children)
-            a) get the current postion for the selected node (this becomes parent node for the children)
-            b) check if a valid position exist (boundary will make few nodes invalid)
-            c) if any node is a wall then ignore that
-            d) add to valid children node list for the selected parent
-
-            For all the children node
-                a) if child in visited list then ignore it and try next node
-                b) calculate child node g, h and f values
-                c) if child in yet_to_visit list then ignore it
-                d) else move the child to yet_to_visit list
+        Space-time A*: plans over (x, y, t) with 4-way moves and waiting, avoiding
+        the cells and swaps reserved by other agents in the reservation table.
+        The end cell may be a wall (e.g. a counter): it is entered only as the last
+        step, which the agent performs as an interaction.
+        :param maze: 2D grid indexed as maze[x][y], cells that are not 0 are walls
+        :param heuristic: (x, y) -> lower bound of the steps to end, negative if unreachable.
+                          Defaults to the Manhattan distance.
+        :param horizon: max number of timesteps to plan ahead. Defaults to 2 * (rows + columns).
+        :return: path[k] is the cell at time t0 + k (path[0] == start), or [] if no path
+                 was found within the horizon
     """
-    #find maze has got how many rows and columns
     no_rows, no_columns = np.shape(maze)
-
-    # Loop until you find the end
-
-    while len(yet_to_visit_list) > 0:
-
-        # Every time any node is referred from yet_to_visit list, counter of limit operation incremented
-        outer_iterations += 1
-
-        # Get the current node
-        current_node = yet_to_visit_list[0]
-        current_index = 0
-        for index, item in enumerate(yet_to_visit_list):
-            if item.f < current_node.f:
-                current_node = item
-                current_index = index
-
-        # if we hit this point return the path such as it may be no solution or
-        # computation cost is too high
-        if outer_iterations > max_iterations:
-            print ("giving up on pathfinding too many iterations")
-            return return_path(current_node,maze)
-
-        # Pop current node out off yet_to_visit list, add to visited list
-        yet_to_visit_list.pop(current_index)
-        visited_list.append(current_node)
-
-        # test if goal is reached or not, if yes then return the path
-        if current_node == end_node:
-            return return_path(current_node,maze)
-
-        # Generate children from all adjacent squares
-        children = []
-
-        for new_position in move:
-
-            # Get node position
-            node_position = (current_node.position[0] + new_position[0], current_node.position[1] + new_position[1])
-
-            # Make sure within range (check if within maze boundary)
-            if (node_position[0] > (no_rows - 1) or
-                node_position[0] < 0 or
-                node_position[1] > (no_columns -1) or
-                node_position[1] < 0):
+    if t0 is None:
+        t0 = reservations.now
+    if horizon is None:
+        horizon = 2 * (no_rows + no_columns)
+    if heuristic is None:
+        heuristic = lambda x, y: abs(x - end[0]) + abs(y - end[1])
+    start = (int(start[0]), int(start[1]))
+    end = (int(end[0]), int(end[1]))
+    h0 = heuristic(*start)
+    if h0 < 0:
+        return []
+    parent = {(start, t0): None}
+    heap = [(h0, h0, 0, start, t0)]
+    counter = 1
+    while heap:
+        _, _, _, cell, t = heapq.heappop(heap)
+        if cell == end:
+            path = []
+            state = (cell, t)
+            while state is not None:
+                path.append(state[0])
+                state = parent[state]
+            return path[::-1]
+        if t - t0 >= horizon:
+            continue
+        x, y = cell
+        for dx, dy in ((-1, 0), (0, -1), (1, 0), (0, 1), (0, 0)):
+            nx, ny = x + dx, y + dy
+            if nx < 0 or nx >= no_rows or ny < 0 or ny >= no_columns:
                 continue
-
-            # Make sure walkable terrain
-            if maze[node_position[0]][node_position[1]] != 0:
+            child = (nx, ny)
+            if maze[nx][ny] != 0 and child != end:
                 continue
-
-            # Create new node
-            new_node = Node(current_node, node_position)
-
-            # Append
-            children.append(new_node)
-
-        # Loop through children
-        for child in children:
-
-            # Child is on the visited list (search entire visited list)
-            if len([visited_child for visited_child in visited_list if visited_child == child]) > 0:
+            state = (child, t + 1)
+            if state in parent:
                 continue
-
-            # Create the f, g, and h values
-            child.g = current_node.g + cost
-            ## Heuristic costs calculated here, this is using eucledian distance
-            child.h = (((child.position[0] - end_node.position[0]) ** 2) +
-                       ((child.position[1] - end_node.position[1]) ** 2))
-
-            child.f = child.g + child.h
-
-            # Child is already in the yet_to_visit list and g cost is already lower
-            if len([i for i in yet_to_visit_list if child == i and child.g > i.g]) > 0:
+            if child != end and not reservations.is_free(agent_id, child, t + 1):
                 continue
-
-            # Add the child to the yet_to_visit list
-            yet_to_visit_list.append(child)
+            if not reservations.is_move_free(agent_id, cell, child, t + 1):
+                continue
+            h = heuristic(nx, ny)
+            if h < 0:
+                continue
+            parent[state] = (cell, t)
+            heapq.heappush(heap, (t + 1 - t0 + h, h, counter, child, t + 1))
+            counter += 1
+    return []
 
 
 __code_block_regex = re.compile(r"```(.*?)```", re.DOTALL)
@@ -345,52 +380,130 @@ def __extract_python_code(content: str) -> str:
             else:
                 #pass
                 full_code += block[0:] + "\n"
-        print(colors.GREEN + "\n=========== execution =============")
-        print(full_code)
-        print("===================================" + colors.ENDC)
+        logger.info(colors.GREEN + "\n=========== execution =============\n%s\n===================================" + colors.ENDC, full_code)
         return full_code
     else:
         return None
 
 
-def get_task_queue(ws, g_chatbot, agent1, agent2):
+def __exec_task_queue(code: str, agent1, agent2) -> list:
+    # existing local vars must be given explicitly as a dict
+    ldict = {"agent1": agent1, "agent2": agent2}
+    exec(code, globals(), ldict)#locals())
+    return ldict["task_queue"]
+
+
+def __best_candidate(g_chatbot, task: str, num_candidates: int, scorer, agent1, agent2):
+    """ request num_candidates plans in one call, execute each of them in its own
+    namespace and return (task_queue, code) of the one with the lowest score
+    (None, None) when no candidate could be executed
+    """
+    responses: List[str] = g_chatbot.sample(task, num_candidates)
+    candidates = []
+    for i, response in enumerate(responses):
+        logger.info("\n-------------------------- candidate %d/%d --------------------------", i + 1, len(responses))
+        logger.info(colors.YELLOW + "ChatGPT: " + colors.ENDC + "%s", response)
+        code = __extract_python_code(response)
+        if not code:
+            logger.warning(colors.RED + "ERROR: candidate %d has no python code" + colors.ENDC, i + 1)
+            continue
+        try:
+            task_queue = __exec_task_queue(code, agent1, agent2)
+        except Exception as e:
+            logger.warning(colors.RED + "ERROR: could not execute candidate %d: %s" + colors.ENDC, i + 1, e)
+            continue
+        score = scorer(task_queue) if scorer is not None else len(task_queue)
+        logger.info("candidate %d: score=%s", i + 1, score)
+        candidates.append((score is None, score or 0, i, task_queue, code, response))
+    if not candidates:
+        g_chatbot.accept(responses[0])
+        return None, None
+    # feasible plans first, then the lowest predicted score, then the first returned
+    _, score, i, task_queue, code, response = min(candidates, key=lambda c: c[:3])
+    logger.info(colors.GREEN + "Using candidate %d (score=%s)" + colors.ENDC, i + 1, score)
+    g_chatbot.accept(response)
+    return task_queue, code
+
+
+def __store_plan(plan_cache, cache_key, code, model, level, task):
+    """ cache a plan that executed; a failing cache write must not cost another LLM call """
+    if plan_cache is None:
+        return
+    try:
+        plan_cache.put(cache_key, code, model=model, level=level, task=task)
+    except OSError as e:
+        logger.warning(colors.RED + "WARNING: could not cache the plan: %s" + colors.ENDC, e)
+
+
+def get_task_queue(ws, g_chatbot, agent1, agent2, plan_cache=None, regenerate: bool=False,
+                   num_candidates: int=1, scorer=None):
+    """ ask the chatbot for a task_queue and execute its code
+    Args:
+        plan_cache (PlanCache, optional): reuse the code of a previous run for the same
+            model, level, task and prompts instead of calling the LLM. Defaults to None.
+        regenerate (bool, optional): ignore a cached plan and ask the LLM again. Defaults to False.
+        num_candidates (int, optional): request this many plans in one call and keep the best. Defaults to 1.
+        scorer (callable, optional): task_queue -> predicted steps (lower is better), None if infeasible.
+            Defaults to the number of subtasks.
+    Raises:
+        RuntimeError: no runnable plan within the retry budget
+    """
     #question = input(colors.GREEN + "Enter a task: " + colors.ENDC)
     task = ws["common"]["task"]
-    print("The task: " + task + colors.ENDC)
-    print(colors.YELLOW + "ChatGPT: Thinking...please wait..." + colors.ENDC)
+    logger.info("The task: %s" + colors.ENDC, task)
+    cache_key = None
+    if plan_cache is not None:
+        cache_key = plan_cache.key(g_chatbot.model, ws["common"]["level"], task, g_chatbot.prompt_digest)
+        code = None if regenerate else plan_cache.get(cache_key)
+        if code is not None:
+            try:
+                task_queue = __exec_task_queue(code, agent1, agent2)
+                logger.info(colors.GREEN + "Using the cached plan %s" + colors.ENDC, cache_key[:12])
+                return task_queue
+            except Exception as e:
+                logger.warning(colors.RED + "ERROR: could not execute the cached plan: %s" + colors.ENDC, e)
+    logger.info(colors.YELLOW + "ChatGPT: Thinking...please wait..." + colors.ENDC)
     num_retries = 0
     max_retries = 5
     while num_retries < max_retries:
+        if num_candidates > 1:
+            task_queue, code = __best_candidate(g_chatbot, task, num_candidates, scorer, agent1, agent2)
+            if task_queue is None:
+                logger.warning(colors.RED + "ERROR: no executable candidate. Retrying..." + colors.ENDC)
+                num_retries += 1
+                continue
+            __store_plan(plan_cache, cache_key, code, g_chatbot.model, ws["common"]["level"], task)
+            break
         response: str = g_chatbot(task)
-        print("\n-------------------------- response --------------------------")
-        print(colors.YELLOW + "ChatGPT: " + colors.ENDC + response)
+        logger.info("\n-------------------------- response --------------------------")
+        logger.info(colors.YELLOW + "ChatGPT: " + colors.ENDC + "%s", response)
         code: str = __extract_python_code(response)
         if code is None:
-            print(colors.RED + "ERROR: no python code found in the response. Retrying..." + colors.ENDC)
+            logger.warning(colors.RED + "ERROR: no python code found in the response. Retrying..." + colors.ENDC)
             num_retries += 1
             question = "You must generate valid Python code. Please try again."
             continue
         else:
             if len(code) == 0:
-                print(colors.RED + "ERROR: python code is empty. Retrying..." + colors.ENDC)
+                logger.warning(colors.RED + "ERROR: python code is empty. Retrying..." + colors.ENDC)
                 num_retries += 1
                 question = "You must generate valid Python code. Please try again."
                 continue
             else:
-                print("\nPlease wait while I execute the above code...")
+                logger.info("\nPlease wait while I execute the above code...")
                 try:
-                    # existing local vars must be given explicitly as a dict
-                    ldict = {"agent1": agent1, "agent2": agent2}
-                    exec(code, globals(), ldict)#locals())
-                    task_queue = ldict["task_queue"]
-                    print("Done executing code.")
-                    break
+                    task_queue = __exec_task_queue(code, agent1, agent2)
+                    logger.info("Done executing code.")
                 except Exception as e:
-                    print(colors.RED + "ERROR: could not execute the code: {}\nRetrying...".format(e) + colors.ENDC)
+                    logger.warning(colors.RED + "ERROR: could not execute the code: %s\nRetrying..." + colors.ENDC, e)
                     num_retries += 1
                     question = "While executing your code I've encountered the following error: {}\nPlease fix the error and show me valid code.".format(e)
                     continue
-    print("Excecuting the task queue in the simulator...")
+                __store_plan(plan_cache, cache_key, code, g_chatbot.model, ws["common"]["level"], task)
+                break
+    else:
+        raise RuntimeError("no runnable plan for the task {!r} after {} attempts".format(task, max_retries))
+    logger.info("Excecuting the task queue in the simulator...")
     return task_queue
 
 
@@ -0,0 +1,125 @@
+from typing import List, Optional, Tuple
+import copy
+import multiprocessing as mp
+import numpy as np
+from overcooked.env import OvercookedEnvGPT
+from overcooked.utils import fix_seed, setup_logging
+
+
+def _worker(remote, parent_remote, num_agents: int, level: str, arglist, seed: int, with_images: bool):
+    parent_remote.close()
+    # worker output would interleave with the other episodes
+    setup_logging(quiet=True)
+    fix_seed(seed=seed)
+    # observations travel through a pipe: a full copy of the environment holds the
+    # pygame renderer and cannot be pickled, so always use the compact observation
+    arglist = copy.copy(arglist)
+    arglist.full_obs_copy = False
+    env = OvercookedEnvGPT(num_agents, level, arglist=arglist)
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == "reset":
+                remote.send(env.reset())
+            elif cmd == "step":
+                obs, reward, done, info = env.step(action_dict=data)
+                # the lazy image handle holds the pygame renderer, which cannot be pickled
+                image_obs = info.get("image_obs")
+                info["image_obs"] = image_obs() if (with_images and image_obs is not None) else None
+                remote.send((obs, reward, done, info))
+            elif cmd == "close":
+                break
+            else:
+                raise ValueError(f"unknown command: {cmd}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        remote.close()
+
+
+class VecOvercookedEnv:
+    """ N independent OvercookedEnvGPT episodes stepped in lockstep, one process each
+    reset() and step() return one entry per episode; rewards and dones are stacked
+    into arrays. An episode that is done is not stepped again until the next
+    reset(); its last observation and info are repeated with a reward of 0.
+    Observations are always compact ObservationRepr tuples (full_obs_copy is
+    ignored) and image observations are rasterized in the workers, as arrays,
+    only with with_images; otherwise info["image_obs"] is None.
+    """
+    def __init__(self, num_agents: int, levels: List[str], arglist, seeds: Optional[List[int]]=None,
+                 with_images: bool=False, start_method: Optional[str]=None):
+        """
+        Args:
+            num_agents (int): agents per episode
+            levels (List[str]): level of each episode (its length is the number of episodes)
+            arglist: arguments shared by all episodes (as parsed by aagpt-overcooked.py)
+            seeds (List[int], optional): seed of each episode. Defaults to arglist.seed + i.
+            with_images (bool, optional): rasterize image observations in the workers. Defaults to False.
+            start_method (str, optional): multiprocessing start method. Defaults to the platform default.
+        """
+        if seeds is None:
+            seeds = [arglist.seed + i for i in range(len(levels))]
+        assert len(seeds) == len(levels), f"{len(seeds)} seeds for {len(levels)} levels"
+        self.levels = list(levels)
+        self.seeds = list(seeds)
+        ctx = mp.get_context(start_method)
+        self.remotes, self.processes = [], []
+        for level, seed in zip(self.levels, self.seeds):
+            remote, work_remote = ctx.Pipe()
+            process = ctx.Process(target=_worker,
+                                  args=(work_remote, remote, num_agents, level, arglist, seed, with_images),
+                                  daemon=True)
+            process.start()
+            work_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+        self.dones = np.zeros(len(self.remotes), dtype=bool)
+        self.last = [None] * len(self.remotes)
+        self.closed = False
+
+    def __len__(self) -> int:
+        return len(self.remotes)
+
+    def reset(self) -> list:
+        for remote in self.remotes:
+            remote.send(("reset", None))
+        self.dones[:] = False
+        self.last = [None] * len(self.remotes)
+        return [remote.recv() for remote in self.remotes]
+
+    def step_async(self, action_dicts: List[dict]):
+        assert len(action_dicts) == len(self.remotes), f"{len(action_dicts)} actions for {len(self.remotes)} episodes"
+        for i, (remote, action_dict) in enumerate(zip(self.remotes, action_dicts)):
+            if not self.dones[i]:
+                remote.send(("step", action_dict))
+
+    def step_wait(self) -> Tuple[list, np.ndarray, np.ndarray, list]:
+        rewards = np.zeros(len(self.remotes), dtype=np.float32)
+        for i, remote in enumerate(self.remotes):
+            if not self.dones[i]:
+                self.last[i] = remote.recv()
+                self.dones[i] = bool(self.last[i][2])
+                rewards[i] = self.last[i][1]
+        obs, _, _, infos = zip(*self.last)
+        return list(obs), rewards, self.dones.copy(), list(infos)
+
+    def step(self, action_dicts: List[dict]) -> Tuple[list, np.ndarray, np.ndarray, list]:
+        """ step every episode that is not done with its action dict
+        Returns:
+            Tuple[list, np.ndarray, np.ndarray, list]: observations, rewards, dones, infos
+        """
+        self.step_async(action_dicts)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        for remote in self.remotes:
+            remote.send(("close", None))
+        for process in self.processes:
+            process.join()
+        self.closed = True
+
+    def __del__(self):
+        if not getattr(self, "closed", True):
+            self.close()
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import openai
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+"""
+Process-wide rate limiting of LLM requests.
+
+Every request takes one unit from a requests/min bucket and its estimated size
+from a tokens/min bucket before it is sent, so several agents (or threads)
+sharing one API key stay under the account limits instead of running into
+them. Rate limit, timeout and server errors are retried with exponential
+backoff and full jitter, up to a retry budget per request.
+"""
+
+# under the overcooked logger, so --quiet and --headless silence the retry notices
+logger = logging.getLogger("overcooked.rate_limiter")
+
+# errors worth retrying: throttling, timeouts and server side failures
+TRANSIENT_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+    openai.error.APIError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIConnectionError,
+    openai.error.TryAgain,
+)
+
+
+class TokenBucket:
+    """ refills `rate` units per minute, holds at most `rate` units """
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = rate
+        self.level = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """ take the amount and return how many seconds to wait before using it
+        The level may go negative: later callers then queue behind this one.
+        """
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate / 60.0)
+            self.updated = now
+            # a single request larger than the bucket would otherwise never fit
+            self.level -= min(amount, self.capacity)
+            if self.level >= 0:
+                return 0.0
+            return -self.level * 60.0 / self.rate
+
+    def refund(self, amount: float):
+        """ give back units that were reserved but not used (may be negative to charge more) """
+        if not self.rate:
+            return
+        with self.lock:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: float=0, tokens_per_minute: float=0,
+                 max_retries: int=6, base_delay: float=1.0, max_delay: float=60.0):
+        """
+        Args:
+            requests_per_minute (float, optional): 0 means unlimited. Defaults to 0.
+            tokens_per_minute (float, optional): 0 means unlimited. Defaults to 0.
+            max_retries (int, optional): retries per request after a transient error. Defaults to 6.
+            base_delay (float, optional): backoff of the first retry in seconds. Defaults to 1.0.
+            max_delay (float, optional): cap of the backoff in seconds. Defaults to 60.0.
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, tokens: int) -> float:
+        """ reserve one request of the given size, return the seconds to wait before sending it """
+        return max(self.requests.reserve(1), self.tokens.reserve(tokens))
+
+    def settle(self, estimated: int, used: int):
+        """ correct the token bucket once the real usage of a request is known """
+        self.tokens.refund(estimated - used)
+
+    def backoff(self, attempt: int, error: Exception=None) -> float:
+        """ seconds to wait before retry number `attempt` (1-based) """
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, f, tokens: int=0):
+        """ call f() within the limits, retrying transient errors
+        Returns:
+            whatever f returns; the last error is raised once the retry budget is spent
+        """
+        attempt = 0
+        while True:
+            time.sleep(self.delay(tokens))
+            try:
+                return f()
+            except TRANSIENT_ERRORS as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                wait = self.backoff(attempt, e)
+                logger.info("%s: %s Retrying in %.1f seconds (%d/%d).", type(e).__name__, e, wait, attempt, self.max_retries)
+                time.sleep(wait)
+
+    async def acall(self, f, tokens: int=0):
+        """ async version of call: f() returns an awaitable """
+        attempt = 0
+        while True:
+            await asyncio.sleep(self.delay(tokens))
+            try:
+                return await f()
+            except TRANSIENT_ERRORS as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                wait = self.backoff(attempt, e)
+                logger.info("%s: %s Retrying in %.1f seconds (%d/%d).", type(e).__name__, e, wait, attempt, self.max_retries)
+                await asyncio.sleep(wait)
+
+
+def _retry_after(error: Exception):
+    """ the Retry-After header of a rate limit error, in seconds """
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
+
+
+_limiter = RateLimiter()
+
+
+def configure(requests_per_minute: float=0, tokens_per_minute: float=0, max_retries: int=6) -> RateLimiter:
+    """ replace the process-wide limiter """
+    global _limiter
+    _limiter = RateLimiter(requests_per_minute, tokens_per_minute, max_retries)
+    return _limiter
+
+
+def configure_from(common: dict) -> RateLimiter:
+    """ configure the process-wide limiter from the `common` section of a config yaml """
+    return configure(common.get("requests_per_minute", 0) or 0,
+                     common.get("tokens_per_minute", 0) or 0,
+                     common.get("max_retries", 6))
+
+
+def get_limiter() -> RateLimiter:
+    return _limiter
+
+
+def count_tokens(text: str, model: str) -> int:
+    """ number of tokens of the text for the model (about 4 characters per token without tiktoken) """
+    if tiktoken is None:
+        return (len(text) + 3) // 4
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return len(encoding.encode(text))
@@ -1,10 +1,18 @@
-import subprocess
-import time
+import asyncio
+import re
+from typing import Iterator, List, Optional
+import aiohttp
 import openai
-import pinecone
+import backends
+import embeddings
+import llm_cache
+import rate_limiter
+from vector_store import LocalVectorIndex
 
 
 OPENAI_API_MODEL = ""
+# max number of LLM requests in flight at once from the async client
+MAX_CONCURRENT_REQUESTS = 8
 
 def common(config):
     # Set up API keys and models from the configuration
@@ -28,6 +36,19 @@ def common(config):
 
     # Configure OpenAI and Pinecone
     openai.api_key = OPENAI_API_KEY
+    # e.g. a local stub server for testing
+    if config['common'].get('openai_api_base'):
+        openai.api_base = config['common']['openai_api_base']
+    global MAX_CONCURRENT_REQUESTS
+    MAX_CONCURRENT_REQUESTS = config['common'].get('max_concurrent_requests', MAX_CONCURRENT_REQUESTS)
+    # requests/min and tokens/min shared by every LLM call of this process
+    rate_limiter.configure_from(config['common'])
+    # recorded LLM responses (common.llm_cache, common.llm_cache_mode: off/record/replay)
+    llm_cache.configure_from(config['common'])
+    # openai_chat, openai_completion, llama or mock (common.backend, defaults to the one serving the model)
+    backends.configure_from(config['common'])
+    # embeddings are cached by content (common.embedding_cache, common.embedding_model)
+    embeddings.configure_from(config['common'])
 
     if config["agent"]["agent_type"] == "agent_pineconemem":
         PINECONE_API_KEY = config['agent']['agent_pinecone_api_key'][0]
@@ -36,6 +57,8 @@ def common(config):
         PINECONE_ENVIRONMENT = config['agent']['agent_pinecone_api_key'][1]
         assert PINECONE_ENVIRONMENT, "PINECONE_ENVIRONMENT environment variable is missing from config yaml"
 
+        # only Pinecone memory needs the pinecone client
+        import pinecone
         pinecone.init(api_key=PINECONE_API_KEY, environment=PINECONE_ENVIRONMENT)
   
 def openai_call(
@@ -43,55 +66,164 @@ def openai_call(
     temperature: float = 0.5,
     max_tokens: int = 100,
 ):
-    model = OPENAI_API_MODEL
-    while True:
+    cache = llm_cache.get_cache()
+    key = cache.key(_cache_model(), prompt, temperature, max_tokens)
+    return cache.lookup(key, lambda: [_openai_call(prompt, temperature, max_tokens)])[0]
+
+
+def _cache_model():
+    # responses of different backends for the same model name must not mix
+    return f"{backends.get_backend().name}:{OPENAI_API_MODEL}"
+
+
+def _openai_call(
+    prompt: str,
+    temperature: float = 0.5,
+    max_tokens: int = 100,
+):
+    return backends.get_backend().complete(prompt, temperature, max_tokens)
+
+
+def openai_call_stream(
+    prompt: str,
+    temperature: float = 0.5,
+    max_tokens: int = 100,
+    stop_patterns: Optional[List[str]] = None,
+    max_chars: Optional[int] = None,
+) -> Iterator[str]:
+    """Streaming version of openai_call: yields the completion in chunks as they arrive.
+    Generation stops early at the first match of one of the stop_patterns (regular
+    expressions, the match is not yielded) or after max_chars characters. A match
+    is assumed to be no longer than its pattern: that many characters are held back
+    until it is clear they do not start a match."""
+    cache = llm_cache.get_cache()
+    key = cache.key(_cache_model(), [prompt, stop_patterns, max_chars], temperature, max_tokens)
+    if cache.mode != "off":
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached[0]
+            return
+        if cache.mode == "replay":
+            raise llm_cache.CacheMiss(f"no recorded LLM response in {cache.path} (key {key[:12]})")
+    stop = re.compile("|".join(f"(?:{p})" for p in stop_patterns)) if stop_patterns else None
+    holdback = max(len(p) for p in stop_patterns) if stop_patterns else 0
+    chunks = backends.get_backend().stream(prompt, temperature, max_tokens)
+    # text received so far, and how much of it was yielded
+    text, sent = "", 0
+    try:
+        for chunk in chunks:
+            if not text:
+                # like openai_call, drop leading whitespace
+                chunk = chunk.lstrip()
+            text += chunk
+            end, stopped = len(text), False
+            if stop is not None:
+                # a match starting before `sent` would have been complete, and found, earlier
+                match = stop.search(text, sent)
+                if match:
+                    end, stopped = match.start(), True
+            if max_chars is not None and max_chars <= end:
+                end, stopped = max_chars, True
+            safe = end if stopped else max(sent, end - holdback)
+            if safe > sent:
+                yield text[sent:safe]
+                sent = safe
+            if stopped:
+                break
+        else:
+            if sent < len(text):
+                yield text[sent:]
+                sent = len(text)
+    finally:
+        # stops the request if the caller or an early stop ended the stream
+        chunks.close()
+    # exactly what the caller got, so a replay matches the live run
+    cache.put(key, [text[:sent]])
+
+
+_async_loop = None
+_async_session = None
+_async_semaphore = None
+
+
+async def _async_resources():
+    """Shared pooled HTTP session and concurrency limit of the running event loop."""
+    global _async_loop, _async_session, _async_semaphore
+    loop = asyncio.get_running_loop()
+    if _async_loop is not loop or _async_session is None or _async_session.closed:
+        previous = _async_session
+        _async_loop = loop
+        _async_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS))
+        _async_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        if previous is not None and not previous.closed:
+            # left open by an earlier event loop
+            try:
+                await previous.close()
+            except RuntimeError:
+                # its connections belonged to a loop that is already closed
+                pass
+    return _async_session, _async_semaphore
+
+
+async def close_async_session():
+    """Close the shared HTTP session (call before the event loop ends)."""
+    global _async_session
+    if _async_session is not None and not _async_session.closed:
+        await _async_session.close()
+    _async_session = None
+
+
+async def openai_call_async(
+    prompt: str,
+    temperature: float = 0.5,
+    max_tokens: int = 100,
+):
+    """Async version of openai_call: requests share one pooled HTTP session and
+    at most MAX_CONCURRENT_REQUESTS of them are in flight at once."""
+    cache = llm_cache.get_cache()
+    key = cache.key(_cache_model(), prompt, temperature, max_tokens)
+    return (await cache.alookup(key, lambda: _openai_call_async(prompt, temperature, max_tokens)))[0]
+
+
+async def _openai_call_async(
+    prompt: str,
+    temperature: float = 0.5,
+    max_tokens: int = 100,
+):
+    session, semaphore = await _async_resources()
+    async with semaphore:
+        openai.aiosession.set(session)
+        return [await backends.get_backend().acomplete(prompt, temperature, max_tokens)]
+
+
+def openai_call_many(
+    prompts: List[str],
+    temperature: float = 0.5,
+    max_tokens: int = 100,
+) -> List[str]:
+    """Synchronous wrapper: run the prompts concurrently, return the results in order."""
+    async def run():
         try:
-            if model.startswith("llama"):
-                # Spawn a subprocess to run llama.cpp
-                cmd = ["llama/main", "-p", prompt]
-                result = subprocess.run(cmd, shell=True, stderr=subprocess.DEVNULL, stdout=subprocess.PIPE, text=True)
-                return result.stdout.strip()
-            elif not model.startswith("gpt-"):
-                # Use completion API
-                response = openai.Completion.create(
-                    engine=model,
-                    prompt=prompt,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    top_p=1,
-                    frequency_penalty=0,
-                    presence_penalty=0,
-                )
-                return response.choices[0].text.strip()
-            else:
-                # Use chat completion API
-                messages = [{"role": "system", "content": prompt}]
-                response = openai.ChatCompletion.create(
-                    model=model,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    n=1,
-                    stop=None,
-                )
-                return response.choices[0].message.content.strip()
-        except openai.error.RateLimitError:
-            print(
-                "The OpenAI API rate limit has been exceeded. Waiting 10 seconds and trying again."
+            return await asyncio.gather(
+                *[openai_call_async(prompt, temperature, max_tokens) for prompt in prompts]
             )
-            time.sleep(10)  # Wait 10 seconds and try again
-        else:
-            break
+        finally:
+            await close_async_session()
+    return list(asyncio.run(run()))
+
 
 def get_ada_embedding(text):
-    """Get the ada embedding of the given text."""
-    text = text.replace("\n", " ")
-    return openai.Embedding.create(input=[text], model="text-embedding-ada-002")[
-        "data"
-    ][0]["embedding"]
+    """Get the ada embedding of the given text (cached by content)."""
+    return embeddings.get_embedder().embed_one(text)
+
+
+def get_ada_embeddings(texts):
+    """Get the ada embeddings of the given texts, the uncached ones in one request."""
+    return embeddings.get_embedder().embed(texts)
 
 def memory_as_pinecone(table_name):
     """Create a Pinecone index with the given table_name."""
+    import pinecone
     dimension = 1536
     metric = "cosine"
     pod_type = "p1"
@@ -100,4 +232,9 @@ def memory_as_pinecone(table_name):
                 table_name, dimension=dimension, metric=metric, pod_type=pod_type
         )
     index = pinecone.Index(table_name)
-    return index
\ No newline at end of file
+    return index
+
+
+def memory_as_local(path):
+    """Create a local vector index, persisted in the directory path (in memory if empty)."""
+    return LocalVectorIndex(path or None)
@@ -0,0 +1,167 @@
+from collections import namedtuple
+from typing import Dict, List, Optional
+import hashlib
+import json
+import os
+import numpy as np
+
+
+"""
+Local vector memory with the upsert/query surface of a Pinecone index.
+
+Each namespace keeps its vectors L2-normalized in one contiguous float32 matrix,
+so a cosine query is a single matrix-vector product followed by an
+argpartition top-k. With a directory, the matrix of a namespace is a
+memory-mapped file (grown by doubling) and ids/metadata go to an append-only
+JSON lines log next to it; both are reloaded on the next run.
+"""
+
+Match = namedtuple("Match", "id score metadata")
+QueryResult = namedtuple("QueryResult", "matches namespace")
+
+
+class _Namespace:
+    def __init__(self, prefix: Optional[str]):
+        self.prefix = prefix
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.metadata: List[Optional[dict]] = []
+        self.vectors: Optional[np.ndarray] = None
+        if prefix is not None and os.path.exists(prefix + ".jsonl"):
+            self.__load()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def upsert(self, id: str, vector: np.ndarray, metadata: Optional[dict]):
+        row = self.rows.get(id)
+        if row is None:
+            row = len(self.ids)
+            self.__reserve(row + 1, vector.shape[0])
+            self.ids.append(id)
+            self.metadata.append(metadata)
+            self.rows[id] = row
+        else:
+            self.metadata[row] = metadata
+        self.vectors[row] = vector
+        if self.prefix is not None:
+            with open(self.prefix + ".jsonl", "a") as f:
+                f.write(json.dumps({"id": id, "row": row, "metadata": metadata}) + "\n")
+
+    def query(self, vector: np.ndarray, top_k: int) -> List[tuple]:
+        """ (row, score) of the top_k most similar vectors, best first """
+        n = len(self.ids)
+        if n == 0 or top_k <= 0:
+            return []
+        scores = self.vectors[:n] @ vector
+        if top_k < n:
+            rows = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            rows = np.arange(n)
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+        return [(int(row), float(scores[row])) for row in rows]
+
+    def flush(self):
+        if isinstance(self.vectors, np.memmap):
+            self.vectors.flush()
+
+    def __reserve(self, size: int, dim: int):
+        if self.vectors is not None:
+            assert self.vectors.shape[1] == dim, f"vector dimension {dim} != index dimension {self.vectors.shape[1]}"
+            if size <= self.vectors.shape[0]:
+                return
+        capacity = max(64, size, 2 * (0 if self.vectors is None else self.vectors.shape[0]))
+        if self.prefix is None:
+            vectors = np.zeros((capacity, dim), dtype=np.float32)
+        else:
+            # a new file of the larger size, the old rows are copied over
+            self.flush()
+            path = self.prefix + ".f32"
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            vectors = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(capacity, dim))
+        if self.vectors is not None:
+            vectors[:len(self.ids)] = self.vectors[:len(self.ids)]
+        if self.prefix is not None:
+            vectors.flush()
+            del vectors
+            self.vectors = None
+            os.replace(tmp_path, path)
+            vectors = np.load(path, mmap_mode="r+")
+        self.vectors = vectors
+
+    def __load(self):
+        with open(self.prefix + ".jsonl", "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a record cut short by a crash
+                    continue
+                row = entry["row"]
+                if row == len(self.ids):
+                    self.ids.append(entry["id"])
+                    self.metadata.append(entry["metadata"])
+                    self.rows[entry["id"]] = row
+                elif row < len(self.ids):
+                    self.metadata[row] = entry["metadata"]
+        if os.path.exists(self.prefix + ".f32"):
+            self.vectors = np.load(self.prefix + ".f32", mmap_mode="r+")
+            # rows past the matrix were never written
+            del self.ids[self.vectors.shape[0]:], self.metadata[self.vectors.shape[0]:]
+            self.rows = {id: row for row, id in enumerate(self.ids)}
+        else:
+            self.ids, self.metadata, self.rows = [], [], {}
+
+
+class LocalVectorIndex:
+    """ in-process replacement of pinecone.Index for upsert/query """
+    def __init__(self, path: Optional[str]=None):
+        """
+        Args:
+            path (str, optional): directory to persist the index in, None keeps it in memory. Defaults to None.
+        """
+        self.path = path
+        if path:
+            os.makedirs(path, exist_ok=True)
+        self.namespaces: Dict[str, _Namespace] = {}
+
+    def upsert(self, vectors: list, namespace: str=""):
+        """
+        Args:
+            vectors (list): (id, values) or (id, values, metadata) tuples
+            namespace (str, optional): Defaults to "".
+        """
+        ns = self.__namespace(namespace)
+        for entry in vectors:
+            id, values = entry[0], entry[1]
+            metadata = entry[2] if len(entry) > 2 else None
+            ns.upsert(str(id), _normalized(values), metadata)
+        ns.flush()
+        return {"upserted_count": len(vectors)}
+
+    def query(self, vector, top_k: int=10, include_metadata: bool=False, namespace: str="") -> QueryResult:
+        """ the top_k vectors of the namespace by cosine similarity, best first """
+        ns = self.__namespace(namespace)
+        matches = [Match(ns.ids[row], score, ns.metadata[row] if include_metadata else None)
+                   for row, score in ns.query(_normalized(vector), top_k)]
+        return QueryResult(matches, namespace)
+
+    def describe_index_stats(self) -> dict:
+        return {"namespaces": {name: {"vector_count": len(ns)} for name, ns in self.namespaces.items()},
+                "total_vector_count": sum(len(ns) for ns in self.namespaces.values())}
+
+    def __namespace(self, namespace: str) -> _Namespace:
+        ns = self.namespaces.get(namespace)
+        if ns is None:
+            prefix = None
+            if self.path:
+                # namespaces are free text (the agent uses its goal), name the files by a digest
+                prefix = os.path.join(self.path, hashlib.sha256(namespace.encode("utf-8")).hexdigest()[:32])
+            ns = self.namespaces[namespace] = _Namespace(prefix)
+        return ns
+
+
+def _normalized(values) -> np.ndarray:
+    vector = np.ascontiguousarray(values, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector